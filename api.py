@@ -0,0 +1,187 @@
+import json
+import os
+import traceback
+from datetime import datetime
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import db
+from photos import store_photo
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+MAX_ENTRIES_PER_REQUEST = 500
+PHOTO_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+# Fields a client may send; totals are optional and must match their
+# counts, as they are recomputed, and photo_name is set from the uploaded
+# file.
+CLIENT_FIELDS = set(db.REQUIRED_ENTRY_FIELDS) | set(db.COUNT_COLUMNS) | {
+    "latitude", "longitude", "accuracy", "created_at", "submission_id", "photo",
+}
+
+# --------------------------------------------------
+# INGESTION API
+# --------------------------------------------------
+# A headless alternative to the Submit button for sync clients:
+#   POST /entries  one entry, a list of entries, or {"entries": [...]} as
+#                  JSON; or multipart/form-data with that JSON in an
+#                  "entries" part plus one file part per photo, referenced
+#                  from an entry as "photo": "<part name>".
+#   GET /doctors   the doctor names entries may use.
+#   GET /health    liveness and schema version.
+# Entries are checked with the Submit handler's rules and the whole request
+# is rejected if any fails. Valid ones go through the same writer queue as
+# the apps, so a request is one transaction, and a submission_id makes
+# retries safe.
+class RequestError(Exception):
+    def __init__(self, status, body):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+
+
+def _parse_entries(payload):
+    if isinstance(payload, dict) and isinstance(payload.get("entries"), list):
+        payload = payload["entries"]
+    entries = payload if isinstance(payload, list) else [payload]
+    if not entries or not all(isinstance(e, dict) for e in entries):
+        raise RequestError(400, {"error": "Expected an entry object or a list of them."})
+    if len(entries) > MAX_ENTRIES_PER_REQUEST:
+        raise RequestError(413, {"error": f"At most {MAX_ENTRIES_PER_REQUEST} entries per request."})
+    return entries
+
+def _parse_json(body):
+    try:
+        return json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise RequestError(400, {"error": f"Invalid JSON: {exc}"})
+
+def _parse_multipart(content_type, body):
+    # Returns (entries payload, {part name: (filename, bytes)}).
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    if not message.is_multipart():
+        raise RequestError(400, {"error": "Malformed multipart body."})
+
+    payload, files = None, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        data = part.get_payload(decode=True) or b""
+        if name == "entries":
+            payload = _parse_json(data)
+        elif name:
+            files[name] = (part.get_filename() or name, data)
+    if payload is None:
+        raise RequestError(400, {"error": 'Multipart body has no "entries" part.'})
+    return payload, files
+
+def _entry_problems(entry, doctors, files):
+    errors = []
+    unknown = sorted(set(entry) - CLIENT_FIELDS)
+    if unknown:
+        errors.append(f"Unknown field(s): {', '.join(unknown)}.")
+    errors += db.entry_errors(entry, doctors)
+
+    photo = entry.get("photo")
+    if photo is not None:
+        if not isinstance(photo, str):
+            errors.append("photo must be the name of an uploaded file part.")
+        elif photo not in files:
+            errors.append(f"No uploaded file named {photo!r}.")
+        elif os.path.splitext(files[photo][0])[1].lower() not in PHOTO_EXTENSIONS:
+            errors.append(f"Photo {files[photo][0]!r} must be a JPG or PNG.")
+    return errors
+
+def ingest(entries, files):
+    # Validates every entry, then stores photos and saves the entries in one
+    # go. Returns one {"id", "inserted"} per entry.
+    doctors = set(db.get_doctors())
+    errors = {
+        str(i): problems
+        for i, entry in enumerate(entries)
+        if (problems := _entry_problems(entry, doctors, files))
+    }
+    if errors:
+        raise RequestError(422, {"errors": errors})
+
+    now = datetime.now().isoformat()
+    rows = []
+    for entry in entries:
+        row = db.complete_entry({k: v for k, v in entry.items() if k != "photo"})
+        row.setdefault("created_at", now)
+        if entry.get("photo") is not None:
+            filename, data = files[entry["photo"]]
+            row["photo_name"] = store_photo(data, filename)
+        rows.append(row)
+
+    return [
+        {"id": entry_id, "inserted": inserted}
+        for entry_id, inserted in db.submit_entries(rows)
+    ]
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    server_version = "OutreachIngest/1"
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _respond(self, handler):
+        # Anything other than a RequestError is a bug or a database
+        # failure: logged, and reported as a 500 rather than a dropped
+        # connection.
+        try:
+            self._send(200, handler())
+        except RequestError as exc:
+            self._send(exc.status, exc.body)
+        except Exception as exc:
+            self.log_error("unexpected error: %r", exc)
+            traceback.print_exc()
+            self._send(500, {"error": "Internal server error."})
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._respond(lambda: {"status": "ok", "schema_version": db.SCHEMA_VERSION})
+        elif self.path == "/doctors":
+            self._respond(lambda: {"doctors": db.get_doctors()})
+        else:
+            self._send(404, {"error": "Not found."})
+
+    def do_POST(self):
+        if self.path != "/entries":
+            self._send(404, {"error": "Not found."})
+            return
+        self._respond(lambda: {"results": ingest(*self._read_entries())})
+
+    def _read_entries(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise RequestError(413, {"error": f"Body larger than {MAX_BODY_BYTES} bytes."})
+        body = self.rfile.read(length)
+
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            return _parse_entries(_parse_json(body)), {}
+        if content_type.startswith("multipart/form-data"):
+            payload, files = _parse_multipart(content_type, body)
+            return _parse_entries(payload), files
+        raise RequestError(415, {"error": "Send application/json or multipart/form-data."})
+
+
+def serve(host="127.0.0.1", port=8600):
+    db.init_db()
+    server = ThreadingHTTPServer((host, port), IngestHandler)
+    print(f"ingestion API on http://{host}:{port} (database {db.DB_PATH})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
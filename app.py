@@ -1,134 +1,27 @@
+import uuid
 import streamlit as st
-import sqlite3
 import pandas as pd
-from datetime import date, datetime
-import os
-from io import BytesIO
-import zipfile
-import base64
+from datetime import date, datetime, timedelta
+import streamlit.components.v1 as components
+
+from db import (
+    init_db, get_doctors, add_doctor, is_doctor_used, delete_doctor,
+    save_entry, entry_errors, complete_entry, get_data_version
+)
+from export import build_share_payload
+from photos import store_photo, thumbnail_path
+import metrics
 # --------------------------------------------------
 # PAGE CONFIG
 # --------------------------------------------------
 st.set_page_config(page_title="NPCBVI SRHU EYE CAMP REPORT", layout="centered")
-
-DB_PATH = "outreach.db"
-IMAGE_DIR = "uploaded_images"
-os.makedirs(IMAGE_DIR, exist_ok=True)
-
-# --------------------------------------------------
-# DATABASE CONNECTION
-# --------------------------------------------------
-def get_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
-
-# --------------------------------------------------
-# DATABASE INITIALIZATION
-# --------------------------------------------------
-def init_db():
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS doctors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL
-        )
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS camp_entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            place TEXT,
-            camp_date TEXT,
-            administrator TEXT,
-            doctor TEXT,
-            optom TEXT,
-            optom_intern TEXT,
-            opd_m INTEGER,
-            opd_f INTEGER,
-            opd_t INTEGER,
-            surg_m INTEGER,
-            surg_f INTEGER,
-            surg_t INTEGER,
-            hosp_m INTEGER,
-            hosp_f INTEGER,
-            hosp_t INTEGER,
-            ciplox INTEGER,
-            ciplox_d INTEGER,
-            cmc INTEGER,
-            fedtive INTEGER,
-            glucose_strips INTEGER,
-            spectacles INTEGER,
-            photo_name TEXT,
-            created_at TEXT
-        )
-    """)
-
-    conn.commit()
-    conn.close()
-
-# --------------------------------------------------
-# DOCTOR HELPERS
-# --------------------------------------------------
-def get_doctors():
-    conn = get_connection()
-    df = pd.read_sql("SELECT name FROM doctors ORDER BY name", conn)
-    conn.close()
-    return df["name"].tolist()
-
-def add_doctor(name):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO doctors (name) VALUES (?)", (name,))
-    conn.commit()
-    conn.close()
-
-def is_doctor_used(name):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM camp_entries WHERE doctor = ?", (name,))
-    count = cur.fetchone()[0]
-    conn.close()
-    return count > 0
-
-def delete_doctor(name):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM doctors WHERE name = ?", (name,))
-    conn.commit()
-    conn.close()
-
-# --------------------------------------------------
-# DATA HELPERS
-# --------------------------------------------------
-def save_entry(data: dict):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("PRAGMA table_info(camp_entries)")
-    columns = [c[1] for c in cur.fetchall() if c[1] != "id"]
-
-    values = [data.get(col) for col in columns]
-    placeholders = ",".join(["?"] * len(values))
-
-    cur.execute(
-        f"INSERT INTO camp_entries ({','.join(columns)}) VALUES ({placeholders})",
-        values
-    )
-
-    conn.commit()
-    conn.close()
-
-def load_all_entries():
-    conn = get_connection()
-    df = pd.read_sql("SELECT * FROM camp_entries", conn)
-    conn.close()
-    return df
+metrics.start_run("app.py")
 
 # --------------------------------------------------
 # INIT DB
 # --------------------------------------------------
 init_db()
+metrics.checkpoint("init")
 
 # --------------------------------------------------
 # SESSION STATE (FOR PREVIEW)
@@ -136,19 +29,26 @@ init_db()
 if "last_submission" not in st.session_state:
     st.session_state.last_submission = None
 
+# One token per form instance. The form is keyed on it, so Submit taps
+# from a form that was already saved are ignored, and the unique index on
+# camp_entries.submission_id catches any that still get through.
+if "submission_id" not in st.session_state:
+    st.session_state.submission_id = uuid.uuid4().hex
+
+if "entry_saved" not in st.session_state:
+    st.session_state.entry_saved = False
+
+# Highest entry id in this session's last shared CSV, for "Since my last
+# share".
+if "last_share_id" not in st.session_state:
+    st.session_state.last_share_id = None
+
 # --------------------------------------------------
 # UI START
 # --------------------------------------------------
 st.title("🩺 NPCBVI SRHU EYE CAMP REPORT")
 
-# ---------------- CAMP DETAILS ----------------
-st.subheader("Camp Details")
-place = st.text_input("Place of Camp")
-camp_date = st.date_input("Date of Camp", value=date.today())
-administrator = st.text_input("Administrator Name")
-
-doctor = st.selectbox("Doctor Name", ["Select"] + get_doctors())
-
+# ---------------- DOCTORS ----------------
 with st.expander("➕ Add New Doctor"):
     new_doctor = st.text_input("Doctor Full Name")
     if st.button("Add Doctor"):
@@ -171,110 +71,133 @@ with st.expander("🗑️ Delete Doctor"):
             st.success(f"Doctor '{doc_to_delete}' deleted successfully.")
             st.rerun()
 
-optom = st.text_input("Optom Name")
-optom_intern = st.text_input("Optom Intern Name")
-
-# ---------------- OPD ----------------
-st.divider()
-st.subheader("OPD Count")
-c1, c2, c3 = st.columns(3)
-opd_m = c1.number_input("Male", 0)
-opd_f = c2.number_input("Female", 0)
-opd_t = opd_m + opd_f
-c3.metric("Total", opd_t)
-
-# ---------------- SURGERY ----------------
-st.subheader("Selected for Surgery")
-c1, c2, c3 = st.columns(3)
-surg_m = c1.number_input("Male ", 0)
-surg_f = c2.number_input("Female ", 0)
-surg_t = surg_m + surg_f
-c3.metric("Total ", surg_t)
-
-# ---------------- HOSPITAL ----------------
-st.subheader("Brought to Hospital")
-c1, c2, c3 = st.columns(3)
-hosp_m = c1.number_input("Male  ", 0)
-hosp_f = c2.number_input("Female  ", 0)
-hosp_t = hosp_m + hosp_f
-c3.metric("Total  ", hosp_t)
-
-# ---------------- MEDICINE ----------------
-st.divider()
-st.subheader("Medicine Distribution")
-c1, c2 = st.columns(2)
-ciplox = c1.number_input("Ciplox", 0)
-ciplox_d = c2.number_input("Ciplox D", 0)
-cmc = c1.number_input("CMC", 0)
-fedtive = c2.number_input("Fedtive", 0)
-glucose_strips = c1.number_input("Glucose Strips", 0)
-
-# ---------------- SPECTACLES ----------------
-st.divider()
-spectacles = st.number_input("Spectacles Given", 0)
-
-# ---------------- PHOTO ----------------
-st.subheader("Camp Photo")
-photo = st.file_uploader("Upload Camp Photo", ["jpg", "jpeg", "png"])
-
-photo_name = None
-if photo:
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    photo_name = f"{ts}_{photo.name.replace(' ', '_')}"
-    with open(os.path.join(IMAGE_DIR, photo_name), "wb") as f:
-        f.write(photo.getbuffer())
-
-# ---------------- SUBMIT ----------------
-if st.button("✅ Submit"):
-    if not all([place, administrator, optom, optom_intern, doctor != "Select"]):
-        st.error("All fields are mandatory.")
-        st.stop()
-
-    if hosp_t > surg_t:
-        st.error("Hospital total cannot exceed surgery total.")
-        st.stop()
-
-    record = {
-        "Place": place,
-        "Camp Date": camp_date,
-        "Administrator": administrator,
-        "Doctor": doctor,
-        "OPD Total": opd_t,
-        "Surgery Total": surg_t,
-        "Hospital Total": hosp_t,
-        "Glucose Strips": glucose_strips,
-        "Spectacles": spectacles,
-        "Photo": photo_name
-    }
+metrics.checkpoint("doctors")
 
-    save_entry({
+# --------------------------------------------------
+# ENTRY FORM
+# --------------------------------------------------
+# Inside st.form, widget edits stay in the browser until Submit, and the
+# fragment keeps a failed Submit from rerunning the share section.
+@st.fragment
+@metrics.fragment("app.py", "entry_form")
+def entry_form():
+    with st.form(f"camp_entry_{st.session_state.submission_id}"):
+        # ---------------- CAMP DETAILS ----------------
+        st.subheader("Camp Details")
+        place = st.text_input("Place of Camp", key="place")
+        camp_date = st.date_input("Date of Camp", value=date.today(), key="camp_date")
+        administrator = st.text_input("Administrator Name")
+
+        doctor = st.selectbox("Doctor Name", ["Select"] + get_doctors())
+
+        optom = st.text_input("Optom Name")
+        optom_intern = st.text_input("Optom Intern Name")
+
+        # ---------------- OPD ----------------
+        st.divider()
+        st.subheader("OPD Count")
+        c1, c2 = st.columns(2)
+        opd_m = c1.number_input("Male", 0)
+        opd_f = c2.number_input("Female", 0)
+
+        # ---------------- SURGERY ----------------
+        st.subheader("Selected for Surgery")
+        c1, c2 = st.columns(2)
+        surg_m = c1.number_input("Male ", 0)
+        surg_f = c2.number_input("Female ", 0)
+
+        # ---------------- HOSPITAL ----------------
+        st.subheader("Brought to Hospital")
+        c1, c2 = st.columns(2)
+        hosp_m = c1.number_input("Male  ", 0)
+        hosp_f = c2.number_input("Female  ", 0)
+
+        # ---------------- MEDICINE ----------------
+        st.divider()
+        st.subheader("Medicine Distribution")
+        c1, c2 = st.columns(2)
+        ciplox = c1.number_input("Ciplox", 0)
+        ciplox_d = c2.number_input("Ciplox D", 0)
+        cmc = c1.number_input("CMC", 0)
+        fedtive = c2.number_input("Fedtive", 0)
+        glucose_strips = c1.number_input("Glucose Strips", 0)
+
+        # ---------------- SPECTACLES ----------------
+        st.divider()
+        spectacles = st.number_input("Spectacles Given", 0)
+
+        # ---------------- PHOTO ----------------
+        st.subheader("Camp Photo")
+        photo = st.file_uploader("Upload Camp Photo", ["jpg", "jpeg", "png"])
+
+        st.caption("Totals are calculated on submit.")
+        submitted = st.form_submit_button("✅ Submit")
+
+    # ---------------- SUBMIT ----------------
+    if not submitted:
+        return
+
+    entry = {
         "place": place,
         "camp_date": str(camp_date),
         "administrator": administrator,
-        "doctor": doctor,
+        "doctor": doctor if doctor != "Select" else None,
         "optom": optom,
         "optom_intern": optom_intern,
         "opd_m": opd_m,
         "opd_f": opd_f,
-        "opd_t": opd_t,
         "surg_m": surg_m,
         "surg_f": surg_f,
-        "surg_t": surg_t,
         "hosp_m": hosp_m,
         "hosp_f": hosp_f,
-        "hosp_t": hosp_t,
         "ciplox": ciplox,
         "ciplox_d": ciplox_d,
         "cmc": cmc,
         "fedtive": fedtive,
         "glucose_strips": glucose_strips,
         "spectacles": spectacles,
-        "photo_name": photo_name,
+        "photo_name": None,
         "created_at": datetime.now().isoformat()
-    })
+    }
+
+    errors = entry_errors(entry)
+    if errors:
+        st.error(errors[0])
+        st.stop()
+    entry = complete_entry(entry)
+
+    # Stored only now that the entry is valid; identical photos share a file.
+    photo_name = store_photo(photo.getvalue(), photo.name) if photo else None
+    entry["photo_name"] = photo_name
+
+    record = {
+        "Place": place,
+        "Camp Date": camp_date,
+        "Administrator": administrator,
+        "Doctor": doctor,
+        "OPD Total": entry["opd_t"],
+        "Surgery Total": entry["surg_t"],
+        "Hospital Total": entry["hosp_t"],
+        "Glucose Strips": glucose_strips,
+        "Spectacles": spectacles,
+        "Photo": photo_name
+    }
+
+    save_entry(entry, st.session_state.submission_id)
+    st.session_state.submission_id = uuid.uuid4().hex
 
     st.session_state.last_submission = record
+    st.session_state.entry_saved = True
+    # The data changed, so let the share section pick up the new row.
+    st.rerun(scope="app")
+
+
+entry_form()
+metrics.checkpoint("entry_form")
+
+if st.session_state.entry_saved:
     st.success("Outreach camp data saved successfully.")
+    st.session_state.entry_saved = False
 
 # ---------------- PREVIEW AFTER SUBMIT ----------------
 if st.session_state.last_submission:
@@ -284,25 +207,75 @@ if st.session_state.last_submission:
         pd.DataFrame([st.session_state.last_submission]),
         use_container_width=True
     )
-
-# ---------------- ZIP EXPORT ---------------
-
-import streamlit.components.v1 as components
-import base64
-
-st.divider()
-st.subheader("📤 Share Camp Data")
-
-df = load_all_entries().drop(columns=["id"], errors="ignore")
-
-if df.empty:
-    st.info("No records available yet.")
-else:
-    safe_place = place.replace(" ", "_") if place else "camp"
-    filename = f"{camp_date}_{safe_place}.csv"
-
-    csv_data = df.to_csv(index=False)
-    b64 = base64.b64encode(csv_data.encode()).decode()
+    # Previews use the small thumbnail, never the full upload.
+    photo_name = st.session_state.last_submission.get("Photo")
+    thumb = thumbnail_path(photo_name) if photo_name else None
+    if thumb:
+        st.image(thumb, width=240)
+
+metrics.checkpoint("preview")
+
+# ---------------- SHARE ----------------
+# The CSV is built and sent only on the run where the user taps Prepare:
+# scoped in SQL, gzipped before base64, and cached per data version. Other
+# reruns never re-send it.
+@st.fragment
+@metrics.fragment("app.py", "share")
+def share_section():
+    st.divider()
+    st.subheader("📤 Share Camp Data")
+
+    version = get_data_version()
+    if version[1] == 0:
+        st.info("No records available yet.")
+        return
+
+    scopes = ["This camp", "Date range", "All records"]
+    if st.session_state.last_share_id is not None:
+        scopes.insert(2, "Since my last share")
+    scope = st.radio("Records to share", scopes, horizontal=True)
+
+    # "This camp" is the last one saved: the form is rebuilt after every
+    # Submit, and its widgets hold nothing until then.
+    last = st.session_state.last_submission or {}
+    place = last.get("Place")
+    camp_date = last.get("Camp Date") or date.today()
+
+    if scope == "This camp":
+        if not place:
+            st.info("Submit a camp entry above to share just this camp.")
+            return
+        filters = {"place": place, "date_from": camp_date, "date_to": camp_date}
+        filename = f"{camp_date}_{place.replace(' ', '_')}.csv"
+    elif scope == "Date range":
+        dates = st.date_input(
+            "Camp dates",
+            value=(camp_date - timedelta(days=7), camp_date)
+        )
+        if len(dates) != 2:
+            return
+        filters = {"date_from": dates[0], "date_to": dates[1]}
+        filename = f"{dates[0]}_to_{dates[1]}.csv"
+    elif scope == "Since my last share":
+        filters = {"since_id": st.session_state.last_share_id}
+        filename = f"outreach_new_{date.today()}.csv"
+    else:
+        filters = {}
+        filename = f"outreach_all_{date.today()}.csv"
+
+    if scope != "This camp":
+        doctor = st.selectbox("Doctor", ["All"] + get_doctors(), key="share_doctor")
+        if doctor != "All":
+            filters["doctor"] = doctor
+
+    if not st.button("Prepare CSV for sharing"):
+        return
+
+    b64, rows = build_share_payload(version, **filters)
+    if rows == 0:
+        st.info("No records match this selection.")
+        return
+    st.session_state.last_share_id = version[0]
 
     components.html(
         f"""
@@ -324,12 +297,23 @@ else:
             <script>
             const b64 = "{b64}";
             const filename = "{filename}";
+            let file = null;
+
+            // Decompress up front so the click handler can call
+            // navigator.share while the tap still counts as user activation.
+            const bytes = Uint8Array.from(atob(b64), c => c.charCodeAt(0));
+            const stream = new Blob([bytes]).stream()
+                .pipeThrough(new DecompressionStream("gzip"));
+            new Response(stream).blob().then(csv => {{
+                file = new File([csv], filename, {{ type: "text/csv" }});
+            }});
 
             document.getElementById("shareBtn").addEventListener("click", async () => {{
                 try {{
-                    const csv = atob(b64);
-                    const blob = new Blob([csv], {{ type: "text/csv" }});
-                    const file = new File([blob], filename, {{ type: "text/csv" }});
+                    if (!file) {{
+                        alert("File is still being prepared, try again.");
+                        return;
+                    }}
 
                     if (navigator.canShare && navigator.canShare({{ files: [file] }})) {{
                         await navigator.share({{
@@ -352,5 +336,15 @@ else:
     )
 
     st.caption(
+        f"{rows} record(s), {len(b64) // 1024 + 1} KB to download. "
         "Works on mobile browsers (Chrome / Safari). Desktop browsers may not support file sharing."
     )
+
+
+share_section()
+metrics.checkpoint("share")
+
+# ---------------- TIMINGS ----------------
+run = metrics.finish_run()
+if metrics.debug_enabled():
+    metrics.render_sidebar(run)
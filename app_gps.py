@@ -1,11 +1,18 @@
+import os
+import uuid
 import streamlit as st
-import sqlite3
 import pandas as pd
 from datetime import date, datetime
-import os
-from io import BytesIO
-import zipfile
 
+from db import (
+    init_db, get_doctors, add_doctor, is_doctor_used, delete_doctor,
+    save_entry, entry_errors, complete_entry, get_data_version,
+    camps_near, find_nearby_duplicates, archive_years,
+    NEARBY_RADIUS_METRES, DUPLICATE_RADIUS_METRES
+)
+from export import submit_export, get_export_job, columnar_available, open_export
+from photos import store_photo, estimate_archive_bytes, thumbnail_path
+import metrics
 # --------------------------------------------------
 # PAGE CONFIG
 # --------------------------------------------------
@@ -13,131 +20,13 @@ st.set_page_config(
     page_title="Outreach Camp Data Entry",
     layout="centered"
 )
-
-DB_PATH = "outreach.db"
-IMAGE_DIR = "uploaded_images"
-os.makedirs(IMAGE_DIR, exist_ok=True)
-
-# --------------------------------------------------
-# DATABASE CONNECTION
-# --------------------------------------------------
-def get_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
-
-# --------------------------------------------------
-# DATABASE INITIALIZATION
-# --------------------------------------------------
-def init_db():
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS doctors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL
-        )
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS camp_entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            place TEXT,
-            camp_date TEXT,
-            administrator TEXT,
-            doctor TEXT,
-            optom TEXT,
-            optom_intern TEXT,
-            opd_m INTEGER,
-            opd_f INTEGER,
-            opd_t INTEGER,
-            surg_m INTEGER,
-            surg_f INTEGER,
-            surg_t INTEGER,
-            hosp_m INTEGER,
-            hosp_f INTEGER,
-            hosp_t INTEGER,
-            ciplox INTEGER,
-            ciplox_d INTEGER,
-            cmc INTEGER,
-            fedtive INTEGER,
-            glucose_strips INTEGER,
-            spectacles INTEGER,
-            photo_name TEXT,
-            latitude REAL,
-            longitude REAL,
-            accuracy REAL,
-            created_at TEXT
-        )
-    """)
-
-    conn.commit()
-    conn.close()
-
-# --------------------------------------------------
-# DOCTOR HELPERS
-# --------------------------------------------------
-def get_doctors():
-    conn = get_connection()
-    df = pd.read_sql("SELECT name FROM doctors ORDER BY name", conn)
-    conn.close()
-    return df["name"].tolist()
-
-def add_doctor(name):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO doctors (name) VALUES (?)", (name,))
-    conn.commit()
-    conn.close()
-
-def is_doctor_used(name):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT COUNT(*) FROM camp_entries WHERE doctor = ?",
-        (name,)
-    )
-    count = cur.fetchone()[0]
-    conn.close()
-    return count > 0
-
-def delete_doctor(name):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM doctors WHERE name = ?", (name,))
-    conn.commit()
-    conn.close()
-
-# --------------------------------------------------
-# DATA HELPERS
-# --------------------------------------------------
-def save_entry(data: dict):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("PRAGMA table_info(camp_entries)")
-    columns = [c[1] for c in cur.fetchall() if c[1] != "id"]
-
-    values = [data.get(col) for col in columns]
-    placeholders = ",".join(["?"] * len(values))
-
-    cur.execute(
-        f"INSERT INTO camp_entries ({','.join(columns)}) VALUES ({placeholders})",
-        values
-    )
-
-    conn.commit()
-    conn.close()
-
-def load_all_entries():
-    conn = get_connection()
-    df = pd.read_sql("SELECT * FROM camp_entries", conn)
-    conn.close()
-    return df
+metrics.start_run("app_gps.py")
 
 # --------------------------------------------------
 # INIT
 # --------------------------------------------------
 init_db()
+metrics.checkpoint("init")
 
 # --------------------------------------------------
 # SESSION STATE (MESSAGES + PREVIEW)
@@ -145,22 +34,32 @@ init_db()
 if "doctor_msg" not in st.session_state:
     st.session_state.doctor_msg = None
 
+if "entry_msg" not in st.session_state:
+    st.session_state.entry_msg = None
+
 if "last_submission" not in st.session_state:
     st.session_state.last_submission = None
 
+# One token per form instance. The form is keyed on it, so Submit taps
+# from a form that was already saved are ignored, and the unique index on
+# camp_entries.submission_id catches any that still get through.
+if "submission_id" not in st.session_state:
+    st.session_state.submission_id = uuid.uuid4().hex
+
+# Id of the background export job this session is waiting on or showing.
+if "export_job" not in st.session_state:
+    st.session_state.export_job = None
+
+# Highest entry id in this session's last filtered CSV export, for "only
+# camps since my last export".
+if "last_export_id" not in st.session_state:
+    st.session_state.last_export_id = None
+
 # --------------------------------------------------
 # UI
 # --------------------------------------------------
 st.title("🩺 Outreach Camp Data Entry")
 
-# ---------------- CAMP DETAILS ----------------
-st.subheader("Camp Details")
-place = st.text_input("Place of Camp")
-camp_date = st.date_input("Date of Camp", value=date.today())
-administrator = st.text_input("Administrator Name")
-
-doctor = st.selectbox("Doctor Name", ["Select"] + get_doctors())
-
 # ---------------- DOCTOR ADD ----------------
 with st.expander("➕ Add New Doctor"):
     new_doctor = st.text_input("Doctor Full Name")
@@ -209,125 +108,169 @@ if st.session_state.doctor_msg:
     elif level == "error":
         st.error(msg)
 
-# ---------------- OTHER DETAILS ----------------
-optom = st.text_input("Optom Name")
-optom_intern = st.text_input("Optom Intern Name")
-
-# ---------------- OPD ----------------
-st.divider()
-st.subheader("OPD Count")
-c1, c2, c3 = st.columns(3)
-opd_m = c1.number_input("Male", 0)
-opd_f = c2.number_input("Female", 0)
-opd_t = opd_m + opd_f
-c3.metric("Total", opd_t)
-
-# ---------------- SURGERY ----------------
-st.subheader("Selected for Surgery")
-c1, c2, c3 = st.columns(3)
-surg_m = c1.number_input("Male ", 0)
-surg_f = c2.number_input("Female ", 0)
-surg_t = surg_m + surg_f
-c3.metric("Total ", surg_t)
-
-# ---------------- HOSPITAL ----------------
-st.subheader("Brought to Hospital")
-c1, c2, c3 = st.columns(3)
-hosp_m = c1.number_input("Male  ", 0)
-hosp_f = c2.number_input("Female  ", 0)
-hosp_t = hosp_m + hosp_f
-c3.metric("Total  ", hosp_t)
-
-# ---------------- MEDICINE ----------------
-st.divider()
-st.subheader("Medicine Distribution")
-c1, c2 = st.columns(2)
-ciplox = c1.number_input("Ciplox", 0)
-ciplox_d = c2.number_input("Ciplox D", 0)
-cmc = c1.number_input("CMC", 0)
-fedtive = c2.number_input("Fedtive", 0)
-glucose_strips = c1.number_input("Glucose Strips", 0)
-
-# ---------------- SPECTACLES ----------------
-st.divider()
-spectacles = st.number_input("Spectacles Given", 0)
-
-# ---------------- GPS (AUTO FROM MOBILE) ----------------
-st.subheader("📍 Camp Location (Auto from Mobile GPS)")
-st.markdown(
-    """
-    <script>
-    navigator.geolocation.getCurrentPosition(
-        (pos) => {
-            const url = new URL(window.location);
-            url.searchParams.set("lat", pos.coords.latitude);
-            url.searchParams.set("lon", pos.coords.longitude);
-            url.searchParams.set("acc", pos.coords.accuracy);
-            window.history.replaceState({}, "", url);
-        }
-    );
-    </script>
-    """,
-    unsafe_allow_html=True
-)
+metrics.checkpoint("doctors")
 
-params = st.experimental_get_query_params()
-latitude = float(params.get("lat", [0])[0]) if "lat" in params else None
-longitude = float(params.get("lon", [0])[0]) if "lon" in params else None
-accuracy = float(params.get("acc", [0])[0]) if "acc" in params else None
-
-if latitude and longitude:
-    st.success(f"Location captured: {latitude:.6f}, {longitude:.6f}")
-
-# ---------------- PHOTO ----------------
-st.subheader("Camp Photo")
-photo = st.file_uploader("Upload Camp Photo", ["jpg", "jpeg", "png"])
-
-photo_name = None
-if photo:
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    photo_name = f"{ts}_{photo.name.replace(' ', '_')}"
-    with open(os.path.join(IMAGE_DIR, photo_name), "wb") as f:
-        f.write(photo.getbuffer())
-
-# ---------------- SUBMIT ----------------
-if st.button("✅ Submit"):
-    if not all([place, administrator, optom, optom_intern, doctor != "Select"]):
-        st.error("All fields are mandatory.")
-        st.stop()
+# --------------------------------------------------
+# ENTRY FORM
+# --------------------------------------------------
+# Inside st.form, widget edits stay in the browser until Submit, and the
+# fragment keeps a failed Submit from rerunning the export section.
+@st.fragment
+@metrics.fragment("app_gps.py", "entry_form")
+def entry_form():
+    # ---------------- GPS (AUTO FROM MOBILE) ----------------
+    st.subheader("📍 Camp Location (Auto from Mobile GPS)")
+    st.markdown(
+        """
+        <script>
+        navigator.geolocation.getCurrentPosition(
+            (pos) => {
+                const url = new URL(window.location);
+                url.searchParams.set("lat", pos.coords.latitude);
+                url.searchParams.set("lon", pos.coords.longitude);
+                url.searchParams.set("acc", pos.coords.accuracy);
+                window.history.replaceState({}, "", url);
+            }
+        );
+        </script>
+        """,
+        unsafe_allow_html=True
+    )
 
-    if hosp_t > surg_t:
-        st.error("Hospital total cannot exceed surgery total.")
-        st.stop()
+    # st.query_params, like metrics.debug_enabled(): Streamlit refuses to mix
+    # it with the removed experimental_get_query_params in one app.
+    params = st.query_params
+    latitude = float(params["lat"]) if "lat" in params else None
+    longitude = float(params["lon"]) if "lon" in params else None
+    accuracy = float(params["acc"]) if "acc" in params else None
+
+    if latitude and longitude:
+        st.success(f"Location captured: {latitude:.6f}, {longitude:.6f}")
+        with st.expander("📌 Camps near here"):
+            nearby = camps_near(latitude, longitude)
+            if nearby.empty:
+                st.caption(f"No camps recorded within {NEARBY_RADIUS_METRES / 1000:g} km.")
+            else:
+                st.dataframe(
+                    nearby[["place", "camp_date", "doctor", "distance_m"]].round({"distance_m": 0}),
+                    hide_index=True,
+                    use_container_width=True
+                )
+
+    with st.form(f"camp_entry_{st.session_state.submission_id}"):
+        # ---------------- CAMP DETAILS ----------------
+        st.subheader("Camp Details")
+        place = st.text_input("Place of Camp", key="place")
+        camp_date = st.date_input("Date of Camp", value=date.today(), key="camp_date")
+        administrator = st.text_input("Administrator Name")
+
+        doctor = st.selectbox("Doctor Name", ["Select"] + get_doctors())
+
+        # ---------------- OTHER DETAILS ----------------
+        optom = st.text_input("Optom Name")
+        optom_intern = st.text_input("Optom Intern Name")
+
+        # ---------------- OPD ----------------
+        st.divider()
+        st.subheader("OPD Count")
+        c1, c2 = st.columns(2)
+        opd_m = c1.number_input("Male", 0)
+        opd_f = c2.number_input("Female", 0)
+
+        # ---------------- SURGERY ----------------
+        st.subheader("Selected for Surgery")
+        c1, c2 = st.columns(2)
+        surg_m = c1.number_input("Male ", 0)
+        surg_f = c2.number_input("Female ", 0)
+
+        # ---------------- HOSPITAL ----------------
+        st.subheader("Brought to Hospital")
+        c1, c2 = st.columns(2)
+        hosp_m = c1.number_input("Male  ", 0)
+        hosp_f = c2.number_input("Female  ", 0)
+
+        # ---------------- MEDICINE ----------------
+        st.divider()
+        st.subheader("Medicine Distribution")
+        c1, c2 = st.columns(2)
+        ciplox = c1.number_input("Ciplox", 0)
+        ciplox_d = c2.number_input("Ciplox D", 0)
+        cmc = c1.number_input("CMC", 0)
+        fedtive = c2.number_input("Fedtive", 0)
+        glucose_strips = c1.number_input("Glucose Strips", 0)
+
+        # ---------------- SPECTACLES ----------------
+        st.divider()
+        spectacles = st.number_input("Spectacles Given", 0)
+
+        # ---------------- PHOTO ----------------
+        st.subheader("Camp Photo")
+        photo = st.file_uploader("Upload Camp Photo", ["jpg", "jpeg", "png"])
+
+        allow_nearby = st.checkbox(
+            "Save even if a camp near this spot is already recorded for this date"
+        )
+
+        st.caption("Totals are calculated on submit.")
+        submitted = st.form_submit_button("✅ Submit")
+
+    # ---------------- SUBMIT ----------------
+    if not submitted:
+        return
 
-    save_entry({
+    entry = {
         "place": place,
         "camp_date": str(camp_date),
         "administrator": administrator,
-        "doctor": doctor,
+        "doctor": doctor if doctor != "Select" else None,
         "optom": optom,
         "optom_intern": optom_intern,
         "opd_m": opd_m,
         "opd_f": opd_f,
-        "opd_t": opd_t,
         "surg_m": surg_m,
         "surg_f": surg_f,
-        "surg_t": surg_t,
         "hosp_m": hosp_m,
         "hosp_f": hosp_f,
-        "hosp_t": hosp_t,
         "ciplox": ciplox,
         "ciplox_d": ciplox_d,
         "cmc": cmc,
         "fedtive": fedtive,
         "glucose_strips": glucose_strips,
         "spectacles": spectacles,
-        "photo_name": photo_name,
+        "photo_name": None,
         "latitude": latitude,
         "longitude": longitude,
         "accuracy": accuracy,
         "created_at": datetime.now().isoformat()
-    })
+    }
+
+    errors = entry_errors(entry)
+    if errors:
+        st.error(errors[0])
+        st.stop()
+    entry = complete_entry(entry)
+
+    if latitude and longitude and not allow_nearby:
+        duplicates = find_nearby_duplicates(latitude, longitude, camp_date)
+        if not duplicates.empty:
+            st.warning(
+                f"{len(duplicates)} camp(s) already recorded within "
+                f"{DUPLICATE_RADIUS_METRES} m on {camp_date}. If this is a "
+                "different camp, tick the box above and submit again."
+            )
+            st.dataframe(
+                duplicates[["place", "doctor", "administrator", "created_at", "distance_m"]],
+                hide_index=True,
+                use_container_width=True
+            )
+            st.stop()
+
+    # Stored only now that the entry is valid; identical photos share a file.
+    photo_name = store_photo(photo.getvalue(), photo.name) if photo else None
+    entry["photo_name"] = photo_name
+
+    _, inserted = save_entry(entry, st.session_state.submission_id)
+    st.session_state.submission_id = uuid.uuid4().hex
 
     st.session_state.last_submission = {
         "Place": place,
@@ -338,7 +281,21 @@ if st.button("✅ Submit"):
         "Photo": photo_name
     }
 
-    st.success("Outreach camp data saved successfully.")
+    st.session_state.entry_msg = (
+        "Outreach camp data saved successfully." if inserted
+        else "This camp was already saved; no duplicate was added."
+    )
+    # The data changed, so let the export section pick up the new row.
+    st.rerun(scope="app")
+
+
+entry_form()
+metrics.checkpoint("entry_form")
+
+# ---------------- ENTRY MESSAGE DISPLAY ----------------
+if st.session_state.entry_msg:
+    st.success(st.session_state.entry_msg)
+    st.session_state.entry_msg = None
 
 # ---------------- PREVIEW AFTER SUBMIT ----------------
 if st.session_state.last_submission:
@@ -348,30 +305,150 @@ if st.session_state.last_submission:
         pd.DataFrame([st.session_state.last_submission]),
         use_container_width=True
     )
+    # Previews use the small thumbnail, never the full upload.
+    photo_name = st.session_state.last_submission.get("Photo")
+    thumb = thumbnail_path(photo_name) if photo_name else None
+    if thumb:
+        st.image(thumb, width=240)
+
+metrics.checkpoint("preview")
+
+# ---------------- EXPORT ----------------
+# Built only after the user asks for it, as a background job that every
+# session asking for the same export shares; the file on disk is reused
+# until get_data_version() changes. The section polls the job for progress
+# without blocking the rest of the page. Parquet/Arrow carry the typed
+# table without images, for analysis. The filtered CSV is selected in SQL,
+# so a week's camps is a small file; it is the one export that can reach
+# the archived years.
+EXPORT_FORMATS = {
+    "ZIP (CSV + Images)": "zip",
+    "ZIP (CSV + compact images)": "zip-compact",
+    "CSV (filtered)": "csv",
+    "Parquet (data only)": "parquet",
+    "Arrow IPC (data only)": "arrow",
+}
+EXPORT_POLL_SECONDS = 1
+EXPORT_MIME = {
+    ".zip": "application/zip",
+    ".csv": "text/csv",
+    ".parquet": "application/vnd.apache.parquet",
+    ".arrow": "application/vnd.apache.arrow.file",
+}
+
+# Polls a running job on its own, every EXPORT_POLL_SECONDS, without
+# blocking the script thread. It is only rendered while the job runs; once
+# the job is done, one full rerun brings up its download and ends the
+# polling.
+@st.fragment(run_every=EXPORT_POLL_SECONDS)
+@metrics.fragment("app_gps.py", "export_progress")
+def export_progress(job_id, label):
+    job = get_export_job(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    st.progress(job.progress, text=f"Preparing {label}… {job.progress:.0%}")
+
+@st.fragment
+@metrics.fragment("app_gps.py", "export")
+def export_section():
+    st.divider()
+    st.subheader("📦 Export Data")
+
+    version = get_data_version()
+    if version[1] == 0:
+        st.info("No records available yet.")
+        return
+
+    reset = lambda: st.session_state.update(export_job=None)
+    formats = [
+        label for label, fmt in EXPORT_FORMATS.items()
+        if fmt in ("zip", "zip-compact", "csv") or columnar_available()
+    ]
+    label = st.radio("Format", formats, horizontal=True, on_change=reset)
+    fmt = EXPORT_FORMATS[label]
+
+    filters = {}
+    if fmt == "csv":
+        c1, c2 = st.columns(2)
+        dates = c1.date_input("Camp dates", value=(), on_change=reset)
+        doctor = c2.selectbox("Doctor", ["All"] + get_doctors(), on_change=reset)
+        place_filter = c1.text_input("Place", on_change=reset)
+        since_last = c2.checkbox(
+            "Only camps since my last export",
+            disabled=st.session_state.last_export_id is None,
+            on_change=reset
+        )
+        filters = {
+            "date_from": dates[0] if dates else None,
+            "date_to": dates[-1] if dates else None,
+            "doctor": None if doctor == "All" else doctor,
+            "place": place_filter.strip() or None,
+            "since_id": st.session_state.last_export_id if since_last else None,
+        }
+        # Camps older than the live database are read from the yearly
+        # archives only when asked for.
+        if archive_years() and st.checkbox("Include archived years", on_change=reset):
+            filters["include_archive"] = True
+
+    if fmt in ("zip", "zip-compact"):
+        # Sized from the photo manifest; photos stored before it existed
+        # are only counted once `manage.py index-photos` has run.
+        image_bytes, unlisted = estimate_archive_bytes(compact=fmt == "zip-compact")
+        note = f" ({unlisted} older photo(s) not counted)" if unlisted else ""
+        st.caption(f"Images: about {image_bytes / 2 ** 20:.1f} MB{note}")
+
+    job = get_export_job(st.session_state.export_job) if st.session_state.export_job else None
+    if job is None:
+        if not st.button(f"Prepare {label}"):
+            return
+        job = submit_export(fmt, version, **filters)
+    elif job.key[1] != tuple(version) or not job.usable():
+        # New camps were saved since, or the file expired: build (or join)
+        # the current export.
+        job = submit_export(fmt, version, **filters)
+    st.session_state.export_job = job.id
+
+    if not job.finished:
+        export_progress(job.id, label)
+        return
+
+    if job.state == "failed":
+        st.error(f"Export failed: {job.error}")
+        st.session_state.export_job = None
+        return
+
+    on_download = None
+    if fmt == "csv":
+        if job.rows == 0:
+            st.info("No records match this selection.")
+            return
+        on_download = lambda: st.session_state.update(last_export_id=version[0])
+        st.caption(f"{job.rows} record(s), {os.path.getsize(job.path) // 1024 + 1} KB")
+
+    last = st.session_state.last_submission or {}
+    place = last.get("Place") or "camp"
+    camp_date = last.get("Camp Date") or date.today()
+    ext = os.path.splitext(job.path)[1]
+
+    def read_export(path=job.path):
+        # Deferred: the file is only read when the button is clicked, not
+        # on every rerun of a session that has a finished export.
+        with open_export(path) as f:
+            return f.read()
 
-# ---------------- ZIP EXPORT ----------------
-st.divider()
-st.subheader("📦 Export Data (CSV + Images)")
-
-df = load_all_entries().drop(columns=["id"], errors="ignore")
+    st.download_button(
+        f"Download {label}",
+        read_export,
+        f"{camp_date}_{place.replace(' ', '_')}{ext}",
+        EXPORT_MIME[ext],
+        on_click=on_download
+    )
 
-if not df.empty:
-    buffer = BytesIO()
-    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-        zipf.writestr("outreach_data.csv", df.to_csv(index=False))
-        for img in df["photo_name"].dropna().unique():
-            path = os.path.join(IMAGE_DIR, img)
-            if os.path.exists(path):
-                zipf.write(path, arcname=f"images/{img}")
 
-    buffer.seek(0)
-    zip_name = f"{camp_date}_{place.replace(' ', '_')}.zip"
+export_section()
+metrics.checkpoint("export")
 
-    st.download_button(
-        "Download ZIP (CSV + Images)",
-        buffer,
-        zip_name,
-        "application/zip"
-    )
-else:
-    st.info("No records available yet.")
+# ---------------- TIMINGS ----------------
+run = metrics.finish_run()
+if metrics.debug_enabled():
+    metrics.render_sidebar(run)
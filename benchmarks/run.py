@@ -0,0 +1,321 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import db
+import export
+import photos
+from benchmarks import synthetic
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+APPS = ["app.py", "app_gps.py"]
+SCALES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+
+# --------------------------------------------------
+# MEASUREMENT
+# --------------------------------------------------
+# Every benchmark is timed `repeat` times without tracing, then run once more
+# under tracemalloc for its peak Python allocation, so tracing overhead
+# never leaks into the latency figures.
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def measure(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "n": repeat,
+        "p50_ms": round(_percentile(samples, 50), 3),
+        "p95_ms": round(_percentile(samples, 95), 3),
+        "p99_ms": round(_percentile(samples, 99), 3),
+        "max_ms": round(max(samples), 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+# --------------------------------------------------
+# HOT PATHS
+# --------------------------------------------------
+def _fresh_entry(data, rng, with_photo=False):
+    entry = synthetic.make_entry(
+        rng, data["places"], data["doctors"], ["Bench Staff"], [],
+        datetime.now().date() - timedelta(days=30), 30
+    )
+    if with_photo:
+        entry["photo_name"] = photos.store_photo(synthetic.make_photo(rng, 150), "bench.jpg")
+    return entry
+
+def bench_data_layer(data, repeat, heavy_repeat, rng):
+    results = {}
+    used_doctor = data["doctors"][0]
+    db.add_doctor("Dr Unused Bench")
+
+    results["get_doctors"] = measure(db.get_doctors, repeat)
+    results["get_doctors_cold"] = measure(
+        db.get_doctors, repeat, setup=db.get_roster().invalidate
+    )
+    results["is_doctor_used"] = measure(lambda: db.is_doctor_used(used_doctor), repeat)
+    results["is_doctor_used_unused"] = measure(
+        lambda: db.is_doctor_used("Dr Unused Bench"), repeat
+    )
+    results["save_entry"] = measure(lambda: db.save_entry(_fresh_entry(data, rng)), repeat)
+
+    batch = [_fresh_entry(data, rng) for _ in range(100)]
+    results["save_entries_100"] = measure(lambda: db.save_entries(batch), repeat)
+
+    results["load_all_entries"] = measure(db.load_all_entries, heavy_repeat)
+    results["load_all_entries_typed"] = measure(
+        lambda: db.load_all_entries(typed=True), heavy_repeat
+    )
+    results["load_entries_projected"] = measure(
+        lambda: db.load_entries(columns=["doctor", "camp_date", "opd_t"], typed=True),
+        heavy_repeat
+    )
+    results["load_entry_page"] = measure(lambda: db.load_entry_page(None, 50), repeat)
+    months = db.get_rollup_months()
+    results["load_rollup_doctor"] = measure(
+        lambda: db.load_rollup("doctor", months[0], months[-1]), repeat
+    )
+    place = data["places"][0]
+    results["search_prefix"] = measure(lambda: db.search_entries(place[:4]), repeat)
+    results["search_typo"] = measure(
+        lambda: db.search_entries(place[:-2] + place[-1]), repeat
+    )
+    results["camps_near"] = measure(lambda: db.camps_near(30.2, 78.5), repeat)
+    results["find_nearby_duplicates"] = measure(
+        lambda: db.find_nearby_duplicates(30.2, 78.5, "2024-01-01"), repeat
+    )
+    results["load_location_clusters"] = measure(db.load_location_clusters, heavy_repeat)
+    return results
+
+def bench_exports(repeat, heavy_repeat, data, rng):
+    results = {}
+    version = db.get_data_version()
+    week_ago = datetime.now().date() - timedelta(days=7)
+
+    results["share_payload_all"] = measure(
+        lambda: export.build_share_payload(version),
+        heavy_repeat,
+        setup=export.build_share_payload.clear
+    )
+    results["share_payload_week"] = measure(
+        lambda: export.build_share_payload(version, date_from=week_ago),
+        repeat,
+        setup=export.build_share_payload.clear
+    )
+
+    def clear_exports():
+        shutil.rmtree(export.EXPORT_DIR, ignore_errors=True)
+
+    results["csv_export_week"] = measure(
+        lambda: export.build_csv(version, date_from=week_ago), repeat, setup=clear_exports
+    )
+    results["zip_export_cold"] = measure(
+        lambda: export.build_zip(db.get_data_version()), heavy_repeat, setup=clear_exports
+    )
+    results["zip_export_incremental"] = measure(
+        lambda: export.build_zip(db.get_data_version()),
+        heavy_repeat,
+        setup=lambda: db.save_entry(_fresh_entry(data, rng, with_photo=True))
+    )
+    results["zip_export_cached"] = measure(
+        lambda: export.build_zip(db.get_data_version()), repeat
+    )
+    if export.columnar_available():
+        results["parquet_export"] = measure(
+            lambda: export.build_columnar(db.get_data_version(), "parquet"),
+            heavy_repeat,
+            setup=clear_exports
+        )
+    return results
+
+# --------------------------------------------------
+# SCRIPTED RERUNS (AppTest)
+# --------------------------------------------------
+def _fill_and_submit(at, doctor):
+    labels = {
+        "Place of Camp": "Bench Village",
+        "Administrator Name": "Bench Admin",
+        "Optom Name": "Bench Optom",
+        "Optom Intern Name": "Bench Intern",
+    }
+    for widget in at.text_input:
+        if widget.label in labels:
+            widget.input(labels[widget.label])
+    next(w for w in at.selectbox if w.label == "Doctor Name").select(doctor)
+    next(b for b in at.button if "Submit" in b.label).click()
+    at.run()
+
+def bench_app(app, repeat, doctor):
+    from streamlit.testing.v1 import AppTest
+
+    path = os.path.join(REPO_DIR, app)
+    results = {}
+    errors = []
+
+    def first_run():
+        at = AppTest.from_file(path, default_timeout=600).run()
+        errors.extend(e.value for e in at.exception)
+        return at
+
+    results["initial_run"] = measure(first_run, repeat)
+    if errors:
+        return {"initial_run": {"error": errors[0]}}
+
+    at = first_run()
+    results["rerun"] = measure(at.run, repeat)
+    results["submit"] = measure(lambda: _fill_and_submit(at, doctor), repeat)
+    if at.exception:
+        results["submit"] = {"error": at.exception[0].value}
+    return results
+
+# --------------------------------------------------
+# DRIVER
+# --------------------------------------------------
+def _use_workdir(path):
+    # Absolute paths, so each scale gets its own cached connection pool.
+    os.makedirs(path, exist_ok=True)
+    db.DB_PATH = os.path.join(path, "outreach.db")
+    photos.IMAGE_DIR = os.path.join(path, "uploaded_images")
+    export.EXPORT_DIR = os.path.join(path, "exports")
+
+def run_scale(rows, workdir, repeat, heavy_repeat, app_repeat):
+    _use_workdir(workdir)
+    start = time.perf_counter()
+    data = synthetic.generate(rows)
+    generate_s = time.perf_counter() - start
+
+    rng = random.Random(1)
+    results = {}
+    results.update(bench_data_layer(data, repeat, heavy_repeat, rng))
+    results.update(bench_exports(repeat, heavy_repeat, data, rng))
+
+    # Run the apps from the scale's directory, as `streamlit run` would.
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for app in APPS:
+            for name, result in bench_app(app, app_repeat, data["doctors"][0]).items():
+                results[f"{app}:{name}"] = result
+    finally:
+        os.chdir(cwd)
+
+    return {"rows": rows, "generate_s": round(generate_s, 2), "results": results}
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run(scales, repeat, heavy_repeat, app_repeat, workdir=None, out=None):
+    workdir = workdir or tempfile.mkdtemp(prefix="outreach_bench_")
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "scales": {},
+    }
+    for scale in scales:
+        print(f"== {scale} ({SCALES[scale]} rows)", file=sys.stderr)
+        report["scales"][scale] = run_scale(
+            SCALES[scale],
+            os.path.join(workdir, f"rows_{SCALES[scale]}"),
+            repeat, heavy_repeat, app_repeat
+        )
+        shutil.rmtree(os.path.join(workdir, f"rows_{SCALES[scale]}"), ignore_errors=True)
+
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        out = os.path.join(RESULTS_DIR, f"{report['commit']}-{stamp}.json")
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    return report, out
+
+# --------------------------------------------------
+# REPORTING
+# --------------------------------------------------
+def print_report(report):
+    for scale, data in report["scales"].items():
+        print(f"\n{scale}: {data['rows']} rows (generated in {data['generate_s']} s)")
+        print(f"{'benchmark':<32}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak KB':>12}")
+        for name, r in data["results"].items():
+            if "error" in r:
+                print(f"{name:<32}  error: {r['error']}")
+                continue
+            print(f"{name:<32}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['peak_kb']:>12}")
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{old['commit']} -> {new['commit']}")
+    for scale, data in new["scales"].items():
+        before = old["scales"].get(scale, {}).get("results", {})
+        print(f"\n{scale}")
+        print(f"{'benchmark':<32}{'old p95':>10}{'new p95':>10}{'change':>10}")
+        for name, r in data["results"].items():
+            b = before.get(name)
+            if not b or "error" in b or "error" in r:
+                continue
+            change = (r["p95_ms"] / b["p95_ms"] - 1) * 100 if b["p95_ms"] else 0.0
+            print(f"{name:<32}{b['p95_ms']:>10}{r['p95_ms']:>10}{change:>+9.1f}%")
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the data-entry and export paths")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["1k", "100k"])
+    parser.add_argument("--repeat", type=int, default=30, help="samples for cheap paths")
+    parser.add_argument("--heavy-repeat", type=int, default=5, help="samples for whole-table paths")
+    parser.add_argument("--app-repeat", type=int, default=5, help="samples for AppTest reruns")
+    parser.add_argument("--workdir", help="where generated databases go (default: a temp dir)")
+    parser.add_argument("--out", help="result JSON path (default: benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report, out = run(
+        args.scales, args.repeat, args.heavy_repeat, args.app_repeat,
+        workdir=args.workdir, out=args.out
+    )
+    print_report(report)
+    print(f"\nresults written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import os
+import random
+from datetime import date, datetime, timedelta
+
+import db
+import photos
+
+CHUNK_ROWS = 50000
+
+SYLLABLES = ["ra", "ma", "pur", "gar", "ha", "ri", "desh", "kot", "na", "li", "sa", "dun", "tal", "bad", "giri"]
+FIRST_NAMES = ["Anil", "Sunita", "Ravi", "Meena", "Arjun", "Kavita", "Suresh", "Pooja", "Vikram", "Neha"]
+LAST_NAMES = ["Sharma", "Rawat", "Negi", "Bisht", "Joshi", "Verma", "Singh", "Thapliyal", "Pant", "Kumar"]
+
+# --------------------------------------------------
+# SYNTHETIC DATA
+# --------------------------------------------------
+# Realistic-looking camp entries for benchmarking: a few thousand villages,
+# tens of doctors and staff, counts in field-plausible ranges (surgery a
+# fraction of OPD, hospital never above surgery) and about one camp in
+# three with a photo drawn from a pool of dummy images. Seeded, so the same
+# scale always produces the same database.
+def _place(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).title()
+
+def _person(rng, title=""):
+    return f"{title}{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+def make_photo(rng, size_kb):
+    # Random bytes behind a JPEG header: incompressible, like a real photo.
+    return b"\xff\xd8\xff\xe0" + rng.randbytes(size_kb * 1024)
+
+def make_entry(rng, places, doctors, staff, photo_names, start, days):
+    camp_date = start + timedelta(days=rng.randrange(days))
+    opd_m, opd_f = rng.randint(10, 160), rng.randint(10, 180)
+    surg_m, surg_f = rng.randint(0, opd_m // 5), rng.randint(0, opd_f // 5)
+    hosp_m, hosp_f = rng.randint(0, surg_m), rng.randint(0, surg_f)
+    created = datetime.combine(camp_date, datetime.min.time()) + timedelta(
+        hours=rng.randint(9, 18), seconds=rng.randrange(3600)
+    )
+    return {
+        "place": rng.choice(places),
+        "camp_date": str(camp_date),
+        "administrator": rng.choice(staff),
+        "doctor": rng.choice(doctors),
+        "optom": rng.choice(staff),
+        "optom_intern": rng.choice(staff),
+        "opd_m": opd_m,
+        "opd_f": opd_f,
+        "opd_t": opd_m + opd_f,
+        "surg_m": surg_m,
+        "surg_f": surg_f,
+        "surg_t": surg_m + surg_f,
+        "hosp_m": hosp_m,
+        "hosp_f": hosp_f,
+        "hosp_t": hosp_m + hosp_f,
+        "ciplox": rng.randint(0, 60),
+        "ciplox_d": rng.randint(0, 40),
+        "cmc": rng.randint(0, 40),
+        "fedtive": rng.randint(0, 30),
+        "glucose_strips": rng.randint(0, 50),
+        "spectacles": rng.randint(0, 80),
+        "latitude": round(29.5 + rng.random() * 1.5, 6),
+        "longitude": round(77.5 + rng.random() * 2.0, 6),
+        "accuracy": round(rng.uniform(3, 50), 1),
+        "photo_name": rng.choice(photo_names) if photo_names and rng.random() < 0.33 else None,
+        "created_at": created.isoformat(),
+    }
+
+def generate(rows, seed=0, n_doctors=40, n_places=3000, n_photos=200, photo_kb=150, years=3):
+    # Fills the database at db.DB_PATH (and photos.IMAGE_DIR) in place.
+    rng = random.Random(seed)
+    db.init_db()
+
+    doctors = sorted({_person(rng, "Dr ") for _ in range(n_doctors * 2)})[:n_doctors]
+    for name in doctors:
+        db.add_doctor(name)
+    places = [_place(rng) for _ in range(n_places)]
+    staff = [_person(rng) for _ in range(60)]
+    photo_names = [
+        photos.store_photo(make_photo(rng, photo_kb), f"camp_{i}.jpg")
+        for i in range(n_photos)
+    ]
+
+    start = date.today() - timedelta(days=365 * years)
+    done = 0
+    while done < rows:
+        n = min(CHUNK_ROWS, rows - done)
+        db.save_entries([
+            make_entry(rng, places, doctors, staff, photo_names, start, 365 * years)
+            for _ in range(n)
+        ])
+        done += n
+    return {"doctors": doctors, "places": places, "photos": photo_names}
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic outreach.db")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dir", default=".", help="where outreach.db and uploaded_images/ go")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--photos", type=int, default=200)
+    parser.add_argument("--photo-kb", type=int, default=150)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.dir, exist_ok=True)
+    db.DB_PATH = os.path.abspath(os.path.join(args.dir, "outreach.db"))
+    photos.IMAGE_DIR = os.path.abspath(os.path.join(args.dir, "uploaded_images"))
+    generate(args.rows, seed=args.seed, n_photos=args.photos, photo_kb=args.photo_kb)
+    print(f"wrote {db.get_data_version()[1]} camp entries to {db.DB_PATH}")
+
+
+if __name__ == "__main__":
+    main()
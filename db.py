@@ -0,0 +1,1527 @@
+import difflib
+import math
+import re
+import sqlite3
+import threading
+import queue
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import metrics
+
+DB_PATH = "outreach.db"
+
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16384
+READ_POOL_SIZE = 8
+
+# Safety net for writes made outside this process (another server, a CLI
+# job): the in-memory roster is reloaded at least this often.
+ROSTER_TTL_SECONDS = 300
+
+ENTRY_INDEX_COLUMNS = ["doctor", "camp_date", "place", "created_at"]
+
+# Identifies the same camp across CSVs, exports and device databases.
+NATURAL_KEY = ["place", "camp_date", "doctor", "created_at"]
+
+# Column types for typed loads: per-camp counts, repeated names and dates.
+COUNT_COLUMNS = [
+    "opd_m", "opd_f", "opd_t",
+    "surg_m", "surg_f", "surg_t",
+    "hosp_m", "hosp_f", "hosp_t",
+    "ciplox", "ciplox_d", "cmc", "fedtive", "glucose_strips",
+    "spectacles",
+]
+CATEGORY_COLUMNS = ["place", "administrator", "doctor", "optom", "optom_intern"]
+
+# What the Submit handler requires of a camp entry: every name filled in,
+# and each total the sum of its male and female counts.
+REQUIRED_ENTRY_FIELDS = ["place", "camp_date"] + CATEGORY_COLUMNS
+ENTRY_TOTALS = {
+    "opd_t": ("opd_m", "opd_f"),
+    "surg_t": ("surg_m", "surg_f"),
+    "hosp_t": ("hosp_m", "hosp_f"),
+}
+DATETIME_COLUMNS = ["camp_date", "created_at"]
+
+# The other fields an entry may carry, by type; any of them may be left
+# out. Dates are stored as ISO text, so month rollups, date ranges and
+# archive years can slice them as strings.
+ENTRY_TEXT_FIELDS = CATEGORY_COLUMNS + ["photo_name", "submission_id"]
+ENTRY_NUMBER_FIELDS = {"latitude": 90, "longitude": 180, "accuracy": None}
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+ISO_DATETIME = re.compile(r"\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?)?")
+# Counts must fit SQLite's INTEGER (and the rollup sums built from them)
+# with room to spare.
+MAX_COUNT = 2**31 - 1
+
+LOAD_CHUNK_ROWS = 20000
+
+# Counts summed into camp_rollups, and the dimensions they are rolled up by
+# (alongside the camp month). "total" has a single empty key per month.
+ROLLUP_MEASURES = COUNT_COLUMNS
+ROLLUP_DIMENSIONS = {
+    "total": None,
+    "doctor": "doctor",
+    "place": "place",
+    "administrator": "administrator",
+}
+
+# Full-text search: the indexed name columns and their bm25 weights, how
+# many of the newest matches get ranked, and how many similar names a
+# misspelt word is checked against.
+SEARCH_COLUMNS = {
+    "place": 4.0,
+    "administrator": 2.0,
+    "doctor": 2.0,
+    "optom": 1.0,
+    "optom_intern": 1.0,
+}
+SEARCH_CANDIDATES = 2000
+SEARCH_FUZZY_NAMES = 30
+
+# GPS lookups: the default "near here" radius, how close a camp on the same
+# date must be to count as a likely duplicate, and the default cluster size
+# for the map (roughly a district).
+NEARBY_RADIUS_METRES = 5000
+DUPLICATE_RADIUS_METRES = 200
+CLUSTER_CELL_KM = 25
+EARTH_RADIUS_METRES = 6371000
+
+# Submissions queued for the writer thread: how many go into one
+# transaction, and how long a session waits for its acknowledgement.
+SUBMIT_BATCH_MAX = 64
+SUBMIT_TIMEOUT_SECONDS = 30
+
+# Archival: where the yearly files of old camps live, and how many days of
+# camps `manage.py archive` keeps in outreach.db by default.
+ARCHIVE_DIR = "archive"
+ARCHIVE_KEEP_DAYS = 365
+
+# --------------------------------------------------
+# QUERIES
+# --------------------------------------------------
+# Every read the app issues, with sample parameters, so `manage.py explain`
+# can print the query plan for each one.
+SQL_DOCTOR_NAMES = "SELECT name FROM doctors ORDER BY name"
+SQL_DOCTOR_USAGE = "SELECT doctor, COUNT(*) FROM camp_entries GROUP BY doctor"
+SQL_ARCHIVED_DOCTOR_USAGE = "SELECT doctor, camps FROM archived_doctor_usage"
+SQL_DOCTOR_USED = (
+    "SELECT EXISTS (SELECT 1 FROM camp_entries WHERE doctor = ?) "
+    "OR EXISTS (SELECT 1 FROM archived_doctor_usage WHERE doctor = ?)"
+)
+SQL_ALL_ENTRIES = "SELECT * FROM camp_entries"
+SQL_DATA_VERSION = "SELECT MAX(id), COUNT(*) FROM camp_entries"
+SQL_ROLLUP_MONTHS = (
+    "SELECT month FROM camp_rollups WHERE dimension = 'total' ORDER BY month"
+)
+SQL_ENTRY_BY_SUBMISSION = "SELECT id FROM camp_entries WHERE submission_id = ?"
+SQL_ENTRY_BY_NATURAL_KEY = (
+    "SELECT 1 FROM camp_entries WHERE "
+    + " AND ".join(f"{col} IS ?" for col in NATURAL_KEY)
+)
+
+# The newest SEARCH_CANDIDATES matches are ranked, so a common word costs
+# the same as a rare one.
+SQL_SEARCH = """
+    SELECT e.* FROM (
+        SELECT rowid, rank FROM camp_search WHERE camp_search MATCH ?
+        ORDER BY rowid DESC LIMIT ?
+    ) s
+    JOIN camp_entries e ON e.id = s.rowid
+    ORDER BY s.rank LIMIT ?
+"""
+SQL_SEARCH_NAMES = (
+    "SELECT name FROM search_names_trigram WHERE search_names_trigram MATCH ? "
+    "ORDER BY rank LIMIT ?"
+)
+
+# camp_locations holds each entry's GPS fix as a point, so a bounding box
+# is an R*Tree lookup plus a primary-key join per hit.
+SQL_ENTRIES_IN_BOX = """
+    SELECT e.* FROM camp_locations l
+    JOIN camp_entries e ON e.id = l.id
+    WHERE l.min_lat >= ? AND l.max_lat <= ? AND l.min_lon >= ? AND l.max_lon <= ?
+"""
+
+# The photos a ZIP export holds: each distinct photo the camps reference,
+# with its manifest row where there is one. {size} is one of
+# ARCHIVE_PHOTO_BYTES; the photo_name index keeps the DISTINCT a scan of
+# the index rather than of the table plus a temporary B-tree.
+ARCHIVE_PHOTO_BYTES = {False: "p.bytes", True: "COALESCE(p.compact_bytes, p.bytes)"}
+SQL_REFERENCED_PHOTOS = (
+    "SELECT DISTINCT photo_name FROM camp_entries WHERE photo_name IS NOT NULL"
+)
+SQL_ARCHIVE_SOURCES = f"""
+    SELECT r.photo_name, p.compact_name, {{size}}
+    FROM ({SQL_REFERENCED_PHOTOS}) r
+    LEFT JOIN photos p ON p.photo_name = r.photo_name
+    ORDER BY r.photo_name
+"""
+SQL_ARCHIVE_BYTES = f"""
+    SELECT COALESCE(SUM({{size}}), 0), COUNT(*) - COUNT(p.photo_name)
+    FROM ({SQL_REFERENCED_PHOTOS}) r
+    LEFT JOIN photos p ON p.photo_name = r.photo_name
+"""
+
+APP_QUERIES = {
+    "doctor_names": (SQL_DOCTOR_NAMES, ()),
+    "doctor_usage": (SQL_DOCTOR_USAGE, ()),
+    "archived_doctor_usage": (SQL_ARCHIVED_DOCTOR_USAGE, ()),
+    "doctor_used": (SQL_DOCTOR_USED, ("Dr Example", "Dr Example")),
+    "all_entries": (SQL_ALL_ENTRIES, ()),
+    "data_version": (SQL_DATA_VERSION, ()),
+    "entry_by_natural_key": (
+        SQL_ENTRY_BY_NATURAL_KEY,
+        ("Rishikesh", "2024-01-01", "Dr Example", "2024-01-01T10:00:00")
+    ),
+    "rollup_months": (SQL_ROLLUP_MONTHS, ()),
+    "rollup_by_doctor": (
+        "SELECT key, SUM(opd_t) FROM camp_rollups "
+        "WHERE dimension = ? AND month BETWEEN ? AND ? GROUP BY key",
+        ("doctor", "2024-01", "2024-12")
+    ),
+    "records_page": (
+        SQL_ALL_ENTRIES + " WHERE 1 AND camp_date IS NOT NULL AND (camp_date, id) < (?, ?) "
+        "ORDER BY camp_date DESC, id DESC LIMIT ?",
+        ("2024-06-01", 50000, 50)
+    ),
+    "records_page_by_doctor": (
+        SQL_ALL_ENTRIES + " WHERE doctor = ? AND camp_date IS NOT NULL "
+        "AND (camp_date, id) < (?, ?) ORDER BY camp_date DESC, id DESC LIMIT ?",
+        ("Dr Example", "2024-06-01", 50000, 50)
+    ),
+    "records_page_by_place_prefix": (
+        SQL_ALL_ENTRIES + " WHERE place >= ? AND place < ? AND camp_date IS NOT NULL "
+        "AND (camp_date, id) < (?, ?) ORDER BY camp_date DESC, id DESC LIMIT ?",
+        ("Ris", "Ris\uffff", "2024-06-01", 50000, 50)
+    ),
+    "records_page_undated": (
+        SQL_ALL_ENTRIES + " WHERE 1 AND camp_date IS NULL AND id < ? ORDER BY id DESC LIMIT ?",
+        (50000, 50)
+    ),
+    "entries_for_camp": (
+        SQL_ALL_ENTRIES + " WHERE place = ? AND camp_date >= ? AND camp_date <= ?",
+        ("Rishikesh", "2024-01-01", "2024-01-01")
+    ),
+    "entries_for_dates": (
+        SQL_ALL_ENTRIES + " WHERE camp_date >= ? AND camp_date <= ?",
+        ("2024-01-01", "2024-01-07")
+    ),
+    "entries_since_id": (SQL_ALL_ENTRIES + " WHERE id > ?", (50000,)),
+    "entry_by_submission": (SQL_ENTRY_BY_SUBMISSION, ("0f1e2d3c4b5a69788796a5b4c3d2e1f0",)),
+    "search": (SQL_SEARCH, ('"rishikesh"*', SEARCH_CANDIDATES, 50)),
+    "search_names": (SQL_SEARCH_NAMES, ('"ris" OR "ish"', SEARCH_FUZZY_NAMES)),
+    "entries_near": (SQL_ENTRIES_IN_BOX, (30.06, 30.15, 78.23, 78.33)),
+    "entries_near_on_date": (
+        SQL_ENTRIES_IN_BOX + " AND e.camp_date = ?",
+        (30.10, 30.11, 78.27, 78.28, "2024-01-01")
+    ),
+    "archive_sources": (SQL_ARCHIVE_SOURCES.format(size=ARCHIVE_PHOTO_BYTES[True]), ()),
+    "archive_bytes": (SQL_ARCHIVE_BYTES.format(size=ARCHIVE_PHOTO_BYTES[True]), ()),
+}
+
+# --------------------------------------------------
+# CONNECTION POOL
+# --------------------------------------------------
+# One writer connection per database file, guarded by a lock, plus a small
+# pool of reader connections. In WAL mode readers never block the writer,
+# so doctor lookups and exports do not hold up a Submit.
+def _connect(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        isolation_level=None,
+        uri=True
+    )
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.set_trace_callback(metrics.count_query)
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path, size=READ_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.schema_version = 0
+        self.entry_insert = None
+        self.entry_writer = None
+        self.writer = _connect(path)
+        self.write_lock = threading.Lock()
+        self.readers = queue.LifoQueue()
+
+    def acquire_reader(self):
+        try:
+            return self.readers.get_nowait()
+        except queue.Empty:
+            return _connect(self.path)
+
+    def release_reader(self, conn):
+        if self.readers.qsize() < self.size:
+            self.readers.put(conn)
+        else:
+            conn.close()
+
+
+# Process-wide objects, one per database file. Kept here rather than in
+# st.cache_resource so the CLI and the ingestion API share this module
+# without a Streamlit runtime.
+_per_database = {}
+_per_database_lock = threading.Lock()
+
+def _shared(kind, path, factory):
+    with _per_database_lock:
+        if (kind, path) not in _per_database:
+            _per_database[(kind, path)] = factory()
+        return _per_database[(kind, path)]
+
+
+def _get_pool(path):
+    return _shared("pool", path, lambda: ConnectionPool(path))
+
+
+def get_pool():
+    return _get_pool(DB_PATH)
+
+
+def readonly_uri(path):
+    return Path(path).absolute().as_uri() + "?mode=ro"
+
+
+@contextmanager
+def _attached(conn, attach):
+    # ATTACH/DETACH are not allowed inside a transaction, so this wraps the
+    # BEGIN rather than running inside it. Other databases (device copies,
+    # yearly archives) are always attached read-only.
+    attached = []
+    try:
+        for alias, path in (attach or {}).items():
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (readonly_uri(path),))
+            attached.append(alias)
+        yield conn
+    finally:
+        for alias in attached:
+            conn.execute(f"DETACH DATABASE {alias}")
+
+
+@contextmanager
+def read_connection(attach=None):
+    pool = get_pool()
+    conn = pool.acquire_reader()
+    try:
+        with _attached(conn, attach):
+            yield conn
+    finally:
+        pool.release_reader(conn)
+
+
+@contextmanager
+def write_connection(attach=None):
+    # BEGIN IMMEDIATE takes the database write lock up front, so another
+    # process (a second server, a CLI job) makes us wait on busy_timeout
+    # instead of failing half way through with "database is locked".
+    pool = get_pool()
+    with pool.write_lock, _attached(pool.writer, attach) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+# --------------------------------------------------
+# SCHEMA MIGRATIONS
+# --------------------------------------------------
+# Step N takes a database from PRAGMA user_version N-1 to N. Databases
+# created before versioning report 0 and may already have some tables, so
+# every step must be safe to run against them.
+def _table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _add_missing_columns(conn, table, columns):
+    existing = _table_columns(conn, table)
+    for name, decl in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+def _migration_1_base_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS doctors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS camp_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            place TEXT,
+            camp_date TEXT,
+            administrator TEXT,
+            doctor TEXT,
+            optom TEXT,
+            optom_intern TEXT,
+            opd_m INTEGER,
+            opd_f INTEGER,
+            opd_t INTEGER,
+            surg_m INTEGER,
+            surg_f INTEGER,
+            surg_t INTEGER,
+            hosp_m INTEGER,
+            hosp_f INTEGER,
+            hosp_t INTEGER,
+            ciplox INTEGER,
+            ciplox_d INTEGER,
+            cmc INTEGER,
+            fedtive INTEGER,
+            glucose_strips INTEGER,
+            spectacles INTEGER,
+            photo_name TEXT,
+            created_at TEXT
+        )
+    """)
+
+def _migration_2_gps_columns(conn):
+    # outreach.db files first created by app.py never got the GPS columns,
+    # so app_gps.py silently dropped the coordinates on save.
+    _add_missing_columns(conn, "camp_entries", [
+        ("latitude", "REAL"),
+        ("longitude", "REAL"),
+        ("accuracy", "REAL"),
+    ])
+
+def _migration_3_entry_indexes(conn):
+    for column in ENTRY_INDEX_COLUMNS:
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_camp_entries_{column} "
+            f"ON camp_entries({column})"
+        )
+
+def _migration_4_natural_key_index(conn):
+    # Not UNIQUE: older databases may already hold duplicate camps. Imports
+    # and merges dedupe against it with NOT EXISTS probes instead.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_camp_entries_natural_key "
+        f"ON camp_entries({', '.join(NATURAL_KEY)})"
+    )
+
+def _migration_5_rollups(conn):
+    measures = ",\n".join(f"{m} INTEGER NOT NULL DEFAULT 0" for m in ROLLUP_MEASURES)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS camp_rollups (
+            dimension TEXT NOT NULL,
+            month TEXT NOT NULL,
+            key TEXT NOT NULL,
+            camps INTEGER NOT NULL DEFAULT 0,
+            {measures},
+            PRIMARY KEY (dimension, month, key)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(_rollup_trigger_sql())
+    _rebuild_rollups(conn)
+
+def _migration_6_doctor_date_index(conn):
+    # Serves the records browser's doctor filter in camp_date order; it also
+    # covers every doctor-only lookup, so the single-column index goes.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_camp_entries_doctor_date "
+        "ON camp_entries(doctor, camp_date)"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_camp_entries_doctor")
+
+def _migration_7_search_index(conn):
+    for sql in _search_schema_sql():
+        conn.execute(sql)
+    _rebuild_search(conn)
+
+def _migration_8_location_index(conn):
+    for sql in _location_schema_sql():
+        conn.execute(sql)
+    _rebuild_locations(conn)
+
+def _migration_9_submission_ids(conn):
+    # One token per form instance; a resubmitted form hits the unique index
+    # instead of adding the camp again. Older rows have no token, and NULLs
+    # never conflict.
+    _add_missing_columns(conn, "camp_entries", [("submission_id", "TEXT")])
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_camp_entries_submission "
+        "ON camp_entries(submission_id)"
+    )
+
+def _migration_10_photo_manifest(conn):
+    # One row per stored photo: its size and dimensions, and the compact and
+    # thumbnail copies once photos.py has made them. Existing photos are
+    # added by `manage.py index-photos`, which has to read the files.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS photos (
+            photo_name TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            compact_name TEXT,
+            compact_bytes INTEGER,
+            thumb_name TEXT,
+            thumb_bytes INTEGER,
+            created_at TEXT
+        )
+    """)
+
+def _migration_11_archived_doctor_usage(conn):
+    # Camps per doctor that `manage.py archive` moved out of camp_entries,
+    # so usage counts and the delete check still see them.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_doctor_usage (
+            doctor TEXT PRIMARY KEY,
+            camps INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+def _migration_12_photo_name_index(conn):
+    # ZIP exports and garbage collection list the distinct referenced
+    # photos; with the index that is no longer a scan of every camp.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_camp_entries_photo_name ON camp_entries(photo_name)"
+    )
+
+MIGRATIONS = [
+    _migration_1_base_tables,
+    _migration_2_gps_columns,
+    _migration_3_entry_indexes,
+    _migration_4_natural_key_index,
+    _migration_5_rollups,
+    _migration_6_doctor_date_index,
+    _migration_7_search_index,
+    _migration_8_location_index,
+    _migration_9_submission_ids,
+    _migration_10_photo_manifest,
+    _migration_11_archived_doctor_usage,
+    _migration_12_photo_name_index,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate():
+    with write_connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for step in MIGRATIONS[version:]:
+            step(conn)
+        version = max(version, SCHEMA_VERSION)
+        conn.execute(f"PRAGMA user_version = {version}")
+    return version
+
+# --------------------------------------------------
+# DATABASE INITIALIZATION
+# --------------------------------------------------
+def init_db():
+    # Migrations run once per process and database file; every later rerun
+    # only compares this integer.
+    pool = get_pool()
+    if pool.schema_version >= SCHEMA_VERSION:
+        return
+    pool.schema_version = migrate()
+    pool.entry_insert = None
+
+# --------------------------------------------------
+# DOCTOR ROSTER CACHE
+# --------------------------------------------------
+# Doctor names and per-doctor usage counts, shared by every session. Names
+# are dropped on add/delete; usage counts are bumped in place by save_entry
+# so is_doctor_used never has to count camp_entries.
+class DoctorRoster:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = None
+        self.usage = None
+        self.names_loaded_at = 0.0
+        self.usage_loaded_at = 0.0
+
+    def _expire(self):
+        now = time.monotonic()
+        if now - self.names_loaded_at > ROSTER_TTL_SECONDS:
+            self.names = None
+        if now - self.usage_loaded_at > ROSTER_TTL_SECONDS:
+            self.usage = None
+
+    def get_names(self):
+        with self.lock:
+            self._expire()
+            if self.names is None:
+                with read_connection() as conn:
+                    rows = conn.execute(SQL_DOCTOR_NAMES).fetchall()
+                self.names = [r[0] for r in rows]
+                self.names_loaded_at = time.monotonic()
+            return list(self.names)
+
+    def get_usage(self, name):
+        with self.lock:
+            self._expire()
+            if self.usage is None:
+                with read_connection() as conn:
+                    rows = conn.execute(SQL_DOCTOR_USAGE).fetchall()
+                    archived = conn.execute(SQL_ARCHIVED_DOCTOR_USAGE).fetchall()
+                self.usage = dict(rows)
+                for name, camps in archived:
+                    self.usage[name] = self.usage.get(name, 0) + camps
+                self.usage_loaded_at = time.monotonic()
+            return self.usage.get(name, 0)
+
+    def record_use(self, name):
+        with self.lock:
+            if self.usage is not None:
+                self.usage[name] = self.usage.get(name, 0) + 1
+
+    def invalidate(self):
+        with self.lock:
+            self.names = None
+
+
+def _get_roster(path):
+    return _shared("roster", path, DoctorRoster)
+
+
+def get_roster():
+    return _get_roster(DB_PATH)
+
+# --------------------------------------------------
+# DOCTOR HELPERS
+# --------------------------------------------------
+@metrics.instrument
+def get_doctors():
+    return get_roster().get_names()
+
+@metrics.instrument
+def add_doctor(name):
+    with write_connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO doctors (name) VALUES (?)", (name,))
+    get_roster().invalidate()
+
+@metrics.instrument
+def is_doctor_used(name):
+    if get_roster().get_usage(name) > 0:
+        return True
+    # A zero count may predate rows written by another process; confirm with
+    # an indexed EXISTS probe before allowing a delete.
+    with read_connection() as conn:
+        return bool(conn.execute(SQL_DOCTOR_USED, (name, name)).fetchone()[0])
+
+@metrics.instrument
+def delete_doctor(name):
+    with write_connection() as conn:
+        conn.execute("DELETE FROM doctors WHERE name = ?", (name,))
+    get_roster().invalidate()
+
+# --------------------------------------------------
+# DATA HELPERS
+# --------------------------------------------------
+def _entry_insert():
+    # (columns, INSERT statement) for camp_entries, built once per schema
+    # version instead of on every save. Because the SQL text never changes,
+    # sqlite3's statement cache also reuses the same prepared statement.
+    pool = get_pool()
+    if pool.entry_insert is None:
+        with read_connection() as conn:
+            cur = conn.execute("PRAGMA table_info(camp_entries)")
+            columns = [c[1] for c in cur.fetchall() if c[1] != "id"]
+        placeholders = ",".join(["?"] * len(columns))
+        sql = (
+            f"INSERT INTO camp_entries ({','.join(columns)}) VALUES ({placeholders}) "
+            "ON CONFLICT (submission_id) DO NOTHING"
+        )
+        pool.entry_insert = (columns, sql)
+    return pool.entry_insert
+
+def entry_columns():
+    return list(_entry_insert()[0])
+
+def entry_errors(data, doctors=None):
+    # The Submit handler's checks, as messages; an empty list means the
+    # entry can be saved. Missing counts count as 0. With `doctors`, the
+    # doctor must also be one of them.
+    errors = []
+    if not all(data.get(field) for field in REQUIRED_ENTRY_FIELDS):
+        errors.append("All fields are mandatory.")
+
+    bad = [
+        field for field in ENTRY_TEXT_FIELDS
+        if data.get(field) is not None and not isinstance(data[field], str)
+    ]
+    if bad:
+        errors.append(f"Must be text: {', '.join(bad)}.")
+
+    camp_date = data.get("camp_date")
+    if camp_date and not _iso(camp_date, ISO_DATE, date):
+        errors.append(f"camp_date {camp_date!r} is not a YYYY-MM-DD date.")
+    created_at = data.get("created_at")
+    if created_at is not None and not _iso(created_at, ISO_DATETIME, datetime):
+        errors.append(f"created_at {created_at!r} is not a YYYY-MM-DDTHH:MM:SS time.")
+
+    bad = [
+        field for field, limit in ENTRY_NUMBER_FIELDS.items()
+        if data.get(field) is not None and not _number_within(data[field], limit)
+    ]
+    if bad:
+        errors.append(f"Out of range or not a number: {', '.join(bad)}.")
+
+    bad = [
+        col for col in COUNT_COLUMNS
+        if data.get(col) is not None and (
+            isinstance(data[col], bool) or not isinstance(data[col], int)
+            or not 0 <= data[col] <= MAX_COUNT
+        )
+    ]
+    if bad:
+        errors.append(f"Counts must be whole numbers from 0 to {MAX_COUNT}: {', '.join(bad)}.")
+    else:
+        # Totals are recomputed on save, so one that was sent must agree.
+        bad = [
+            f"{total} ({data[total]} is not {male} + {female})"
+            for total, (male, female) in ENTRY_TOTALS.items()
+            if data.get(total) is not None and data[total] != _total(data, total)
+        ]
+        if bad:
+            errors.append(f"Totals must equal their counts: {', '.join(bad)}.")
+        elif _total(data, "hosp_t") > _total(data, "surg_t"):
+            errors.append("Hospital total cannot exceed surgery total.")
+
+    doctor = data.get("doctor")
+    if doctors is not None and doctor and isinstance(doctor, str) and doctor not in doctors:
+        errors.append(f"Unknown doctor {doctor!r}.")
+    return errors
+
+def _iso(value, pattern, kind):
+    # fromisoformat alone also takes forms like 20240701.
+    if not isinstance(value, str) or not pattern.fullmatch(value):
+        return False
+    try:
+        kind.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+def _number_within(value, limit):
+    # A finite number, within +-limit if there is one and 0 or more if not.
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return False
+    return abs(value) <= limit if limit else value >= 0
+
+def _total(data, total):
+    male, female = ENTRY_TOTALS[total]
+    return (data.get(male) or 0) + (data.get(female) or 0)
+
+def complete_entry(data):
+    # A copy of a valid entry with its totals filled in from the counts.
+    entry = dict(data)
+    for total in ENTRY_TOTALS:
+        entry[total] = _total(data, total)
+    return entry
+
+@metrics.instrument
+def save_entries(entries):
+    # Any number of entries in one transaction and one commit, for bulk
+    # callers; entries whose submission_id is already stored are skipped.
+    columns, sql = _entry_insert()
+    rows = [[data.get(col) for col in columns] for data in entries]
+
+    with write_connection() as conn:
+        conn.executemany(sql, rows)
+
+    roster = get_roster()
+    for data in entries:
+        roster.record_use(data.get("doctor"))
+
+# --------------------------------------------------
+# WRITE QUEUE
+# --------------------------------------------------
+# Form submissions from every session go through one writer thread. It
+# takes whatever is queued (up to about SUBMIT_BATCH_MAX entries) and
+# inserts it in a single transaction, so a burst of Submits costs one
+# commit and never contends for the write lock. Each caller blocks on its
+# own Futures, which resolve to (entry id, inserted) once the transaction
+# has committed. If the shared transaction fails, every caller's entries
+# are retried in a transaction of their own, so a bad entry only fails
+# the call it came in.
+class EntryWriter:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="entry-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, entries):
+        # One queue item per call, so a caller's entries share a transaction.
+        jobs = [(data, Future()) for data in entries]
+        self.queue.put(jobs)
+        return [future for _, future in jobs]
+
+    def _next_batch(self):
+        # A list of queued calls, each a list of (entry, Future).
+        batch = [self.queue.get()]
+        size = len(batch[0])
+        while size < SUBMIT_BATCH_MAX:
+            try:
+                jobs = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(jobs)
+            size += len(jobs)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._commit(batch)
+            except BaseException as exc:
+                if len(batch) == 1:
+                    self._fail(batch[0], exc)
+                    continue
+                for jobs in batch:
+                    try:
+                        self._commit([jobs])
+                    except BaseException as exc:
+                        self._fail(jobs, exc)
+
+    def _commit(self, batch):
+        jobs = [job for call in batch for job in call]
+        results = self._write(jobs)
+        for (_, future), result in zip(jobs, results):
+            future.set_result(result)
+
+    def _fail(self, jobs, exc):
+        # The transaction was rolled back, so nothing in it was saved.
+        for _, future in jobs:
+            future.set_exception(exc)
+
+    def _write(self, batch):
+        columns, sql = _entry_insert()
+        results = []
+        with write_connection() as conn:
+            for data, _ in batch:
+                cur = conn.execute(sql, [data.get(col) for col in columns])
+                if cur.rowcount:
+                    results.append((cur.lastrowid, True))
+                else:
+                    # Already stored by an earlier Submit of the same form
+                    # (possibly earlier in this very batch).
+                    row = conn.execute(SQL_ENTRY_BY_SUBMISSION, (data["submission_id"],)).fetchone()
+                    results.append((row[0], False))
+
+        roster = get_roster()
+        for (data, _), (_, inserted) in zip(batch, results):
+            if inserted:
+                roster.record_use(data.get("doctor"))
+        return results
+
+
+_entry_writer_lock = threading.Lock()
+
+def get_entry_writer():
+    pool = get_pool()
+    with _entry_writer_lock:
+        if pool.entry_writer is None:
+            pool.entry_writer = EntryWriter()
+    return pool.entry_writer
+
+@metrics.instrument
+def save_entry(data: dict, submission_id=None, timeout=SUBMIT_TIMEOUT_SECONDS):
+    # Queues one entry for the writer thread and waits until it is committed.
+    # Saving again with the same submission_id stores nothing new. Returns
+    # (entry id, inserted), where inserted is False for a repeat.
+    if submission_id is not None:
+        data = {**data, "submission_id": submission_id}
+    return submit_entries([data], timeout)[0]
+
+@metrics.instrument
+def submit_entries(entries, timeout=SUBMIT_TIMEOUT_SECONDS):
+    # Several entries through the writer thread in one transaction; each may
+    # carry its own submission_id. Returns one (entry id, inserted) per
+    # entry, in order.
+    futures = get_entry_writer().submit(entries)
+    deadline = time.monotonic() + timeout
+    return [f.result(max(0, deadline - time.monotonic())) for f in futures]
+
+@metrics.instrument
+def load_all_entries(columns=None, typed=False):
+    return load_entries(columns=columns, typed=typed)
+
+def _entry_filter(place=None, date_from=None, date_to=None, doctor=None, place_prefix=None,
+                  since_id=None):
+    clauses, params = [], []
+    if place:
+        clauses.append("place = ?")
+        params.append(place)
+    if place_prefix:
+        # A range rather than LIKE, so the place index can be used.
+        clauses.append("place >= ? AND place < ?")
+        params.extend([place_prefix, place_prefix + "\uffff"])
+    if doctor:
+        clauses.append("doctor = ?")
+        params.append(doctor)
+    if date_from:
+        clauses.append("camp_date >= ?")
+        params.append(str(date_from))
+    if date_to:
+        clauses.append("camp_date <= ?")
+        params.append(str(date_to))
+    if since_id:
+        # Entries added after an earlier export that went up to this id.
+        clauses.append("id > ?")
+        params.append(int(since_id))
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+def _select_entries(columns=None, table="camp_entries", **filters):
+    # Only the requested columns, filtered in SQL on the place/camp_date
+    # indexes rather than in pandas.
+    if columns:
+        unknown = set(columns) - set(["id"] + entry_columns())
+        if unknown:
+            raise ValueError(f"unknown camp_entries column(s): {', '.join(sorted(unknown))}")
+    select = ", ".join(columns) if columns else "*"
+    where, params = _entry_filter(**filters)
+    return f"SELECT {select} FROM {table}{where}", params
+
+def _compact_counts(values):
+    values = pd.to_numeric(values, errors="coerce")
+    largest = values.abs().max()
+    if pd.isna(largest) or largest < 2 ** 15:
+        return values.astype("Int16")
+    if largest < 2 ** 31:
+        return values.astype("Int32")
+    return values.astype("Int64")
+
+def _typed(df):
+    # Counts as the smallest nullable integer that fits, names as
+    # categoricals and dates as datetimes: a fraction of the memory of the
+    # int64/object columns pandas infers.
+    for col in df.columns:
+        if col in COUNT_COLUMNS:
+            df[col] = _compact_counts(df[col])
+        elif col in CATEGORY_COLUMNS:
+            df[col] = df[col].astype("category")
+        elif col in DATETIME_COLUMNS:
+            df[col] = pd.to_datetime(df[col], errors="coerce", format="ISO8601")
+    return df
+
+def _concat_entries(chunks):
+    if len(chunks) == 1:
+        return chunks[0]
+    # Chunks have their own categories; give them a shared set first so the
+    # columns stay categorical after the concat.
+    for col in CATEGORY_COLUMNS:
+        if col in chunks[0] and isinstance(chunks[0][col].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([c[col] for c in chunks]).categories
+            for c in chunks:
+                c[col] = c[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+@metrics.instrument
+def load_entries(place=None, date_from=None, date_to=None, columns=None, typed=False, **filters):
+    # `columns` projects in SQL; `typed` converts chunk by chunk, so the
+    # wide inferred frame never exists for the whole result.
+    return _concat_entries(list(iter_entries(
+        LOAD_CHUNK_ROWS, columns, typed,
+        place=place, date_from=date_from, date_to=date_to, **filters
+    )))
+
+@metrics.instrument
+def load_entry_page(cursor=None, limit=50, **filters):
+    # Keyset pagination, newest camp first: `cursor` is the (camp_date, id)
+    # of the last row on the previous page, so every page is an index seek
+    # however deep it is. Rows without a camp_date follow all dated rows.
+    # Returns (page DataFrame, cursor for the next page or None).
+    where, params = _entry_filter(**filters)
+    where = where or " WHERE 1"
+    cursor_date, cursor_id = cursor or (None, None)
+
+    with read_connection() as conn:
+        frames = []
+        if cursor is None or cursor_date is not None:
+            seek = " AND (camp_date, id) < (?, ?)" if cursor else ""
+            frames.append(pd.read_sql(
+                f"{SQL_ALL_ENTRIES}{where} AND camp_date IS NOT NULL{seek} "
+                "ORDER BY camp_date DESC, id DESC LIMIT ?",
+                conn,
+                params=params + list(cursor or []) + [limit]
+            ))
+        remaining = limit - sum(len(f) for f in frames)
+        if remaining > 0 and not (filters.get("date_from") or filters.get("date_to")):
+            seek = " AND id < ?" if cursor_id is not None and cursor_date is None else ""
+            frames.append(pd.read_sql(
+                f"{SQL_ALL_ENTRIES}{where} AND camp_date IS NULL{seek} "
+                "ORDER BY id DESC LIMIT ?",
+                conn,
+                params=params + ([cursor_id] if seek else []) + [remaining]
+            ))
+
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    if len(df) < limit:
+        return df, None
+    last = df.iloc[-1]
+    return df, (last["camp_date"], int(last["id"]))
+
+def iter_entries(chunksize=5000, columns=None, typed=False, include_archive=False, **filters):
+    # Yields DataFrames of at most `chunksize` rows, so exports never hold
+    # the whole table in memory. Takes the same columns/typed/filters as
+    # load_entries; with include_archive, the yearly archives the date
+    # filters reach follow the live rows.
+    sql, params = _select_entries(columns, **filters)
+    with read_connection() as conn:
+        for chunk in pd.read_sql(sql, conn, params=params, chunksize=chunksize):
+            yield _typed(chunk) if typed else chunk
+
+    if include_archive:
+        for year in archive_years(filters.get("date_from"), filters.get("date_to")):
+            for chunk in _iter_archive(year, chunksize, columns, **filters):
+                yield _typed(chunk) if typed else chunk
+
+def count_entries(include_archive=False, **filters):
+    where, params = _entry_filter(**filters)
+    with read_connection() as conn:
+        count = conn.execute(f"SELECT COUNT(*) FROM camp_entries{where}", params).fetchone()[0]
+    if include_archive:
+        for year in archive_years(filters.get("date_from"), filters.get("date_to")):
+            with read_connection(attach={"arc": archive_path(year)}) as conn:
+                count += conn.execute(
+                    f"SELECT COUNT(*) FROM arc.camp_entries{where}", params
+                ).fetchone()[0]
+    return count
+
+@metrics.instrument
+def get_data_version():
+    # (max id, row count): changes whenever a camp entry is added or removed,
+    # so it can key caches of anything derived from the whole table.
+    with read_connection() as conn:
+        max_id, count = conn.execute(SQL_DATA_VERSION).fetchone()
+    return (max_id or 0, count)
+
+# --------------------------------------------------
+# ROLLUPS
+# --------------------------------------------------
+# camp_rollups holds per-month totals by doctor, place and administrator.
+# An AFTER INSERT trigger folds every new camp entry into it, whether it
+# comes from save_entry, an import or a merge, so the dashboard never has
+# to aggregate camp_entries. Entries are never edited in place; after any
+# manual change run `manage.py rebuild-rollups`.
+def _rollup_key(dimension, prefix=""):
+    column = ROLLUP_DIMENSIONS[dimension]
+    return f"COALESCE({prefix}{column}, '')" if column else "''"
+
+def _rollup_trigger_sql():
+    columns = ", ".join(ROLLUP_MEASURES)
+    values = ", ".join(f"COALESCE(NEW.{m}, 0)" for m in ROLLUP_MEASURES)
+    updates = ", ".join(f"{m} = {m} + excluded.{m}" for m in ROLLUP_MEASURES)
+    statements = "".join(f"""
+            INSERT INTO camp_rollups (dimension, month, key, camps, {columns})
+            VALUES (
+                '{dimension}', COALESCE(substr(NEW.camp_date, 1, 7), ''),
+                {_rollup_key(dimension, "NEW.")}, 1, {values}
+            )
+            ON CONFLICT (dimension, month, key)
+            DO UPDATE SET camps = camps + 1, {updates};"""
+        for dimension in ROLLUP_DIMENSIONS
+    )
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS camp_entries_rollup
+        AFTER INSERT ON camp_entries
+        BEGIN{statements}
+        END
+    """
+
+def _add_rollups(conn, table="camp_entries", where="true", params=(), sign=1):
+    # Adds the camps in `table` matching `where` to camp_rollups, merging
+    # into months that are already there (a year split between outreach.db
+    # and its archive). sign=-1 takes them away instead.
+    columns = ", ".join(ROLLUP_MEASURES)
+    sums = ", ".join(f"{sign} * COALESCE(SUM({m}), 0)" for m in ROLLUP_MEASURES)
+    updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in ["camps"] + ROLLUP_MEASURES)
+    for dimension in ROLLUP_DIMENSIONS:
+        conn.execute(f"""
+            INSERT INTO camp_rollups (dimension, month, key, camps, {columns})
+            SELECT ?, COALESCE(substr(camp_date, 1, 7), ''), {_rollup_key(dimension)},
+                   {sign} * COUNT(*), {sums}
+            FROM {table}
+            WHERE {where}
+            GROUP BY 2, 3
+            ON CONFLICT (dimension, month, key) DO UPDATE SET {updates}
+        """, (dimension, *params))
+    if sign < 0:
+        conn.execute("DELETE FROM camp_rollups WHERE camps <= 0")
+
+def _rebuild_rollups(conn):
+    conn.execute("DELETE FROM camp_rollups")
+    _add_rollups(conn)
+
+def rebuild_rollups():
+    # Archived camps stay in the rollups, so each yearly file is added back
+    # in. One attach per transaction keeps clear of SQLite's limit on
+    # attached databases; the dashboard may briefly show a partial history.
+    with write_connection() as conn:
+        _rebuild_rollups(conn)
+    for year in archive_years():
+        with write_connection(attach={"arc": archive_path(year)}) as conn:
+            _add_rollups(conn, "arc.camp_entries")
+
+@metrics.instrument
+def get_rollup_months():
+    with read_connection() as conn:
+        rows = conn.execute(SQL_ROLLUP_MONTHS).fetchall()
+    return [r[0] for r in rows]
+
+@metrics.instrument
+def load_rollup(dimension, month_from, month_to):
+    # "total" is reported per month; the other dimensions are summed over
+    # the month range and reported per doctor/place/administrator.
+    group = "month" if dimension == "total" else "key"
+    sums = ", ".join(f"SUM({m}) AS {m}" for m in ["camps"] + ROLLUP_MEASURES)
+    with read_connection() as conn:
+        df = pd.read_sql(
+            f"""
+            SELECT {group} AS {dimension if group == "key" else "month"}, {sums}
+            FROM camp_rollups
+            WHERE dimension = ? AND month BETWEEN ? AND ?
+            GROUP BY {group}
+            ORDER BY {group}
+            """,
+            conn,
+            params=(dimension, month_from, month_to)
+        )
+    return df
+
+# --------------------------------------------------
+# SEARCH
+# --------------------------------------------------
+# camp_search is an FTS5 index over the name columns of camp_entries
+# (external content, so the text is stored once), with a prefix index for
+# search-as-you-type. search_names keeps each distinct name once, under a
+# trigram index: a misspelt word is matched against those names and
+# replaced by the closest real words. Triggers keep both in step with
+# camp_entries, whatever writes to it.
+def _search_schema_sql():
+    columns = ", ".join(SEARCH_COLUMNS)
+    new = ", ".join(f"NEW.{col}" for col in SEARCH_COLUMNS)
+    old = ", ".join(f"OLD.{col}" for col in SEARCH_COLUMNS)
+    names = " UNION ".join(
+        f"SELECT NEW.{col} AS name" for col in SEARCH_COLUMNS
+    )
+    weights = ", ".join(str(w) for w in SEARCH_COLUMNS.values())
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS camp_search USING fts5(
+            {columns},
+            content='camp_entries', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        f"INSERT INTO camp_search (camp_search, rank) VALUES ('rank', 'bm25({weights})')",
+        "CREATE TABLE IF NOT EXISTS search_names (name TEXT PRIMARY KEY)",
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_names_trigram USING fts5(
+            name, content='search_names', tokenize='trigram'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS camp_entries_search_insert
+        AFTER INSERT ON camp_entries
+        BEGIN
+            INSERT INTO camp_search (rowid, {columns}) VALUES (NEW.id, {new});
+            INSERT OR IGNORE INTO search_names (name)
+            SELECT name FROM ({names}) WHERE name IS NOT NULL AND name != '';
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS camp_entries_search_delete
+        AFTER DELETE ON camp_entries
+        BEGIN
+            INSERT INTO camp_search (camp_search, rowid, {columns})
+            VALUES ('delete', OLD.id, {old});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS camp_entries_search_update
+        AFTER UPDATE ON camp_entries
+        BEGIN
+            INSERT INTO camp_search (camp_search, rowid, {columns})
+            VALUES ('delete', OLD.id, {old});
+            INSERT INTO camp_search (rowid, {columns}) VALUES (NEW.id, {new});
+            INSERT OR IGNORE INTO search_names (name)
+            SELECT name FROM ({names}) WHERE name IS NOT NULL AND name != '';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS search_names_insert
+        AFTER INSERT ON search_names
+        BEGIN
+            INSERT INTO search_names_trigram (rowid, name) VALUES (NEW.rowid, NEW.name);
+        END
+        """,
+    ]
+
+def _rebuild_search(conn):
+    conn.execute("INSERT INTO camp_search (camp_search) VALUES ('rebuild')")
+    names = " UNION ".join(f"SELECT {col} AS name FROM camp_entries" for col in SEARCH_COLUMNS)
+    conn.execute(
+        f"INSERT OR IGNORE INTO search_names (name) "
+        f"SELECT name FROM ({names}) WHERE name IS NOT NULL AND name != ''"
+    )
+    conn.execute("INSERT INTO search_names_trigram (search_names_trigram) VALUES ('rebuild')")
+
+def rebuild_search():
+    with write_connection() as conn:
+        _rebuild_search(conn)
+
+def _search_words(text):
+    return re.findall(r"\w+", text.lower())
+
+def _match_expression(alternatives, column=None):
+    # One group per query word, all required; each group matches any of its
+    # words as a prefix. Words are \w+ only, so quoting them is enough.
+    groups = [
+        "(" + " OR ".join(f'"{word}"*' for word in words) + ")"
+        for words in alternatives
+    ]
+    expression = " AND ".join(groups)
+    return f"{column} : ({expression})" if column else expression
+
+def _search(conn, alternatives, column, limit):
+    return pd.read_sql(
+        SQL_SEARCH,
+        conn,
+        params=(_match_expression(alternatives, column), SEARCH_CANDIDATES, limit)
+    )
+
+def _close_words(conn, word):
+    # Names sharing the most trigrams with the word, then the words in them
+    # that difflib rates closest. Words under three letters have no trigrams.
+    if len(word) < 3:
+        return []
+    trigrams = {word[i:i + 3] for i in range(len(word) - 2)}
+    names = conn.execute(
+        SQL_SEARCH_NAMES,
+        (" OR ".join(f'"{t}"' for t in sorted(trigrams)), SEARCH_FUZZY_NAMES)
+    ).fetchall()
+    words = {w for (name,) in names for w in _search_words(name)}
+    return difflib.get_close_matches(word, words, n=3, cutoff=0.75)
+
+@metrics.instrument
+def search_entries(query, column=None, limit=50):
+    # Ranked camp entries whose names contain every word of `query` as a
+    # prefix, optionally in one column only. When nothing matches, misspelt
+    # words are swapped for the closest indexed words and the search runs
+    # again. Returns (DataFrame, {word: [replacements]}).
+    words = _search_words(query)
+    if not words:
+        return pd.DataFrame(), {}
+
+    with read_connection() as conn:
+        df = _search(conn, [[w] for w in words], column, limit)
+        corrections = {}
+        if df.empty:
+            alternatives = []
+            for word in words:
+                close = _close_words(conn, word)
+                if close and word not in close:
+                    corrections[word] = close
+                alternatives.append(close or [word])
+            if corrections:
+                df = _search(conn, alternatives, column, limit)
+    return df, corrections
+
+# --------------------------------------------------
+# LOCATIONS
+# --------------------------------------------------
+# camp_locations is an R*Tree over the GPS fix of every camp entry that has
+# one, stored as a zero-size box. Triggers keep it in step with
+# camp_entries. R*Tree coordinates are 32-bit floats rounded outwards, so
+# distances are always computed from the exact camp_entries columns.
+_HAS_FIX = "{row}.latitude IS NOT NULL AND {row}.longitude IS NOT NULL"
+
+def _location_schema_sql():
+    insert = """
+            INSERT INTO camp_locations (id, min_lat, max_lat, min_lon, max_lon)
+            SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+            WHERE {has_fix};""".format(has_fix=_HAS_FIX.format(row="NEW"))
+    delete = """
+            DELETE FROM camp_locations WHERE id = OLD.id;"""
+    return [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS camp_locations USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS camp_entries_location_insert
+        AFTER INSERT ON camp_entries
+        BEGIN{insert}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS camp_entries_location_delete
+        AFTER DELETE ON camp_entries
+        BEGIN{delete}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS camp_entries_location_update
+        AFTER UPDATE OF latitude, longitude ON camp_entries
+        BEGIN{delete}{insert}
+        END
+        """,
+    ]
+
+def _rebuild_locations(conn):
+    conn.execute("DELETE FROM camp_locations")
+    conn.execute(f"""
+        INSERT INTO camp_locations (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT id, latitude, latitude, longitude, longitude
+        FROM camp_entries
+        WHERE {_HAS_FIX.format(row="camp_entries")}
+    """)
+
+def rebuild_locations():
+    with write_connection() as conn:
+        _rebuild_locations(conn)
+
+def distance_metres(lat1, lon1, lat2, lon2):
+    # Haversine: plenty for the few kilometres these lookups cover.
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METRES * math.asin(math.sqrt(a))
+
+def _bounding_box(lat, lon, radius_m):
+    # (min_lat, max_lat, min_lon, max_lon) around a circle of radius_m.
+    dlat = math.degrees(radius_m / EARTH_RADIUS_METRES)
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+def _entries_within(lat, lon, radius_m, camp_date=None, limit=None):
+    sql = SQL_ENTRIES_IN_BOX
+    params = list(_bounding_box(lat, lon, radius_m))
+    if camp_date is not None:
+        sql += " AND e.camp_date = ?"
+        params.append(str(camp_date))
+    with read_connection() as conn:
+        df = pd.read_sql(sql, conn, params=params)
+
+    # The box's corners lie outside the circle; trim them, nearest first.
+    df["distance_m"] = [
+        distance_metres(lat, lon, a, b) for a, b in zip(df["latitude"], df["longitude"])
+    ]
+    df = df[df["distance_m"] <= radius_m].sort_values("distance_m", kind="stable")
+    return df.head(limit).reset_index(drop=True) if limit else df.reset_index(drop=True)
+
+@metrics.instrument
+def camps_near(lat, lon, radius_m=NEARBY_RADIUS_METRES, limit=50):
+    # Camp entries within radius_m of (lat, lon), nearest first, with a
+    # distance_m column.
+    return _entries_within(lat, lon, radius_m, limit=limit)
+
+@metrics.instrument
+def find_nearby_duplicates(lat, lon, camp_date, radius_m=DUPLICATE_RADIUS_METRES):
+    # Entries already recorded within radius_m of (lat, lon) on camp_date:
+    # most likely the same camp entered twice.
+    return _entries_within(lat, lon, radius_m, camp_date=camp_date)
+
+@metrics.instrument
+def load_location_clusters(cell_km=CLUSTER_CELL_KM, date_from=None, date_to=None):
+    # Camps grouped into square cells of about cell_km a side, each placed
+    # at the mean position of its camps. Cells are bands of latitude by
+    # bands of longitude, so they narrow a little towards the poles.
+    cell_deg = math.degrees(cell_km * 1000 / EARTH_RADIUS_METRES)
+    where, params = _entry_filter(date_from=date_from, date_to=date_to)
+    with read_connection() as conn:
+        df = pd.read_sql(
+            f"""
+            SELECT CAST((l.min_lat + 90) / ? AS INTEGER) AS cell_lat,
+                   CAST((l.min_lon + 180) / ? AS INTEGER) AS cell_lon,
+                   AVG(e.latitude) AS latitude, AVG(e.longitude) AS longitude,
+                   COUNT(*) AS camps, SUM(e.opd_t) AS opd_t,
+                   SUM(e.surg_t) AS surg_t, SUM(e.hosp_t) AS hosp_t
+            FROM camp_locations l
+            JOIN camp_entries e ON e.id = l.id{where}
+            GROUP BY 1, 2
+            ORDER BY camps DESC
+            """,
+            conn,
+            params=[cell_deg, cell_deg] + params
+        )
+    return df
+
+# --------------------------------------------------
+# ARCHIVE
+# --------------------------------------------------
+# Camps dated before a cutoff move out of outreach.db into one file per
+# camp year (archive/outreach_2023.db), so the database every Submit and
+# page load touches holds only recent history. Archived camps still count
+# in the dashboard rollups and in doctor usage (archived_doctor_usage), but
+# drop out of search and the map. Historical loads and exports pass
+# include_archive=True, which attaches the yearly files read-only.
+def archive_path(year):
+    return str(Path(ARCHIVE_DIR) / f"outreach_{year}.db")
+
+def archive_years(date_from=None, date_to=None):
+    # Years with an archive file, limited to those a date range reaches.
+    years = []
+    for path in Path(ARCHIVE_DIR).glob("outreach_*.db"):
+        year = path.stem.split("_", 1)[1]
+        if year.isdigit():
+            years.append(int(year))
+    first = int(str(date_from)[:4]) if date_from else None
+    last = int(str(date_to)[:4]) if date_to else None
+    return sorted(
+        y for y in years
+        if (first is None or y >= first) and (last is None or y <= last)
+    )
+
+def _iter_archive(year, chunksize, columns=None, **filters):
+    # A yearly file keeps the columns camp_entries had when it was written;
+    # ones added since come back empty.
+    wanted = columns or ["id"] + entry_columns()
+    with read_connection(attach={"arc": archive_path(year)}) as conn:
+        present = {row[1] for row in conn.execute("PRAGMA arc.table_info(camp_entries)")}
+        sql, params = _select_entries(
+            [c for c in wanted if c in present], "arc.camp_entries", **filters
+        )
+        for chunk in pd.read_sql(sql, conn, params=params, chunksize=chunksize):
+            yield chunk.reindex(columns=wanted)
+
+def _open_archive(year, columns):
+    # Rollback-journal mode rather than WAL, so each yearly file is a single
+    # self-contained file that can be copied around or opened with ?mode=ro.
+    Path(ARCHIVE_DIR).mkdir(exist_ok=True)
+    conn = sqlite3.connect(archive_path(year), timeout=BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None)
+    decls = ", ".join(f"{name} {decl}" for name, decl in columns)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS camp_entries (id INTEGER PRIMARY KEY, {decls})")
+    _add_missing_columns(conn, "camp_entries", columns)
+    for column in ENTRY_INDEX_COLUMNS:
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_camp_entries_{column} "
+            f"ON camp_entries({column})"
+        )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_camp_entries_natural_key "
+        f"ON camp_entries({', '.join(NATURAL_KEY)})"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_camp_entries_photo_name ON camp_entries(photo_name)"
+    )
+    return conn
+
+@metrics.instrument
+def archive_entries(before):
+    # Moves camps dated before `before` (a date or YYYY-MM-DD) into their
+    # yearly files. Each year is committed to its file first and only then
+    # deleted here, so a crash in between leaves the rows in both places
+    # (and in historical loads twice) until the next run finishes the move.
+    # Camps already in the file under their natural key are not copied
+    # again. Returns {year: camps moved}.
+    before = str(before)
+    with read_connection() as conn:
+        columns = [
+            (row[1], row[2]) for row in conn.execute("PRAGMA table_info(camp_entries)")
+            if row[1] != "id"
+        ]
+        max_id = conn.execute("SELECT MAX(id) FROM camp_entries").fetchone()[0]
+        years = [int(row[0]) for row in conn.execute(
+            "SELECT DISTINCT substr(camp_date, 1, 4) FROM camp_entries "
+            "WHERE camp_date < ? AND camp_date GLOB '[0-9][0-9][0-9][0-9]-*'",
+            (before,)
+        )]
+
+    names = ", ".join(name for name, _ in columns)
+    same_camp = " AND ".join(f"a.{col} IS e.{col}" for col in NATURAL_KEY)
+    # Rows present when we started only: anything saved meanwhile has a
+    # higher id and waits for the next run.
+    where = "e.camp_date >= ? AND e.camp_date < ? AND e.id <= ?"
+    moved = {}
+    for year in years:
+        params = (f"{year}-01-01", min(before, f"{year + 1}-01-01"), max_id)
+
+        archive = _open_archive(year, columns)
+        try:
+            archive.execute("ATTACH DATABASE ? AS live", (readonly_uri(DB_PATH),))
+            archive.execute("BEGIN IMMEDIATE")
+            archive.execute(f"""
+                INSERT OR IGNORE INTO camp_entries (id, {names})
+                SELECT e.id, {", ".join(f"e.{name}" for name, _ in columns)}
+                FROM live.camp_entries e
+                WHERE {where}
+                AND NOT EXISTS (SELECT 1 FROM camp_entries a WHERE {same_camp})
+            """, params)
+            archive.execute("COMMIT")
+        finally:
+            archive.close()
+
+        archived = f"{where} AND EXISTS (SELECT 1 FROM arc.camp_entries a WHERE {same_camp})"
+        with write_connection(attach={"arc": archive_path(year)}) as conn:
+            # Counted by id, so a re-imported copy of a camp that is already
+            # archived is not counted twice.
+            conn.execute(f"""
+                INSERT INTO archived_doctor_usage (doctor, camps)
+                SELECT e.doctor, COUNT(*) FROM camp_entries e
+                WHERE {where} AND e.doctor IS NOT NULL
+                AND e.id IN (SELECT id FROM arc.camp_entries)
+                GROUP BY e.doctor
+                ON CONFLICT (doctor) DO UPDATE SET camps = camps + excluded.camps
+            """, params)
+            # Moved camps stay in camp_rollups, which is only added to on
+            # insert; live copies of camps that were already archived are
+            # taken out of it, as they are not moved anywhere.
+            _add_rollups(
+                conn, "camp_entries AS e",
+                f"{archived} AND e.id NOT IN (SELECT id FROM arc.camp_entries)", params, sign=-1
+            )
+            # The search and location triggers drop the rows from those indexes.
+            moved[year] = conn.execute(
+                f"DELETE FROM camp_entries AS e WHERE {archived}", params
+            ).rowcount
+    return moved
+
+def archived_camps(keys):
+    # The NATURAL_KEY tuples among `keys` whose camp is already in its
+    # year's archive, so imports and merges do not bring archived camps back.
+    years = set(archive_years())
+    by_year = {}
+    for key in keys:
+        camp_date = key[NATURAL_KEY.index("camp_date")]
+        year = str(camp_date)[:4] if camp_date else ""
+        if year.isdigit() and int(year) in years:
+            by_year.setdefault(int(year), []).append(key)
+
+    sql = "SELECT 1 FROM arc.camp_entries WHERE " + " AND ".join(f"{col} IS ?" for col in NATURAL_KEY)
+    found = set()
+    for year, year_keys in by_year.items():
+        with read_connection(attach={"arc": archive_path(year)}) as conn:
+            found.update(key for key in year_keys if conn.execute(sql, key).fetchone())
+    return found
+
+def vacuum():
+    # Hands the pages freed by archival back to the filesystem. VACUUM
+    # rewrites the whole file and cannot run inside a transaction.
+    pool = get_pool()
+    with pool.write_lock:
+        pool.writer.execute("VACUUM")
+
+# --------------------------------------------------
+# DIAGNOSTICS
+# --------------------------------------------------
+def explain_queries(queries=None):
+    queries = APP_QUERIES if queries is None else queries
+    with read_connection() as conn:
+        for name, (sql, params) in queries.items():
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            yield name, sql, [row[3] for row in plan]
@@ -0,0 +1,638 @@
+import base64
+import copy
+import glob
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet/Arrow export is optional
+    pa = None
+
+import metrics
+from db import (
+    CATEGORY_COLUMNS, COUNT_COLUMNS, count_entries, entry_columns, iter_entries,
+    read_connection
+)
+from photos import archive_sources
+
+EXPORT_DIR = "exports"
+CSV_CHUNK_ROWS = 5000
+
+# How long an artifact of a superseded data version is kept, and how long a
+# finished export job is remembered.
+EXPORT_GRACE_SECONDS = 600
+EXPORT_JOB_TTL_SECONDS = 3600
+EXPORT_WORKERS = 2
+
+# Photos are already JPEG/PNG-compressed; deflating them again costs CPU
+# and saves almost nothing.
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+COLUMNAR_BATCH_ROWS = 20000
+COLUMNAR_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+_export_lock = threading.Lock()
+_path_locks = {}
+_csv_rows = {}
+
+# --------------------------------------------------
+# SHARE PAYLOAD
+# --------------------------------------------------
+# Gzipped, base64-encoded CSV for the Web Share button, scoped in SQL to one
+# camp, a date range, a doctor or the entries added since an earlier share.
+# Keyed on db.get_data_version(), so every session reuses the same payload
+# until a camp entry is added. The CSV is streamed into gzip chunk by chunk,
+# so "All records" never holds the table or its uncompressed text in memory.
+@st.cache_data(show_spinner=False, max_entries=32)
+@metrics.instrument
+def build_share_payload(version, place=None, date_from=None, date_to=None, doctor=None,
+                        since_id=None):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+        with io.TextIOWrapper(gz, encoding="utf-8", newline="") as out:
+            rows = write_csv(out, iter_entries(
+                CSV_CHUNK_ROWS, entry_columns(),
+                place=place, date_from=date_from, date_to=date_to,
+                doctor=doctor, since_id=since_id
+            ))
+    return base64.b64encode(buf.getvalue()).decode(), rows
+
+# --------------------------------------------------
+# CSV EXPORT
+# --------------------------------------------------
+def write_csv(out, chunks, progress=None):
+    # progress, if given, is called with the running row count.
+    header, rows = True, 0
+    for chunk in chunks:
+        chunk.drop(columns=["id"], errors="ignore").to_csv(out, index=False, header=header)
+        header = False
+        rows += len(chunk)
+        if progress:
+            progress(rows)
+    return rows
+
+# A CSV of just the entries matching the filters (place, doctor, date_from,
+# date_to, since_id, include_archive), selected in SQL and written to disk
+# CSV_CHUNK_ROWS at a time. Kept per data version and filter set, so
+# repeated downloads of the same selection are a file read. Returns
+# (path, rows).
+def _filter_key(filters):
+    text = repr(sorted((k, str(v)) for k, v in filters.items() if v))
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+@metrics.instrument
+def build_csv(version, progress=None, **filters):
+    max_id, count = version
+    path = os.path.join(EXPORT_DIR, f"outreach_{max_id}_{count}_{_filter_key(filters)}.csv")
+
+    with _path_lock(path):
+        if path in _csv_rows and os.path.exists(path):
+            return path, _csv_rows[path]
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+
+        total = count_entries(**filters) if progress else 0
+        fd, tmp = tempfile.mkstemp(dir=EXPORT_DIR, suffix=".tmp")
+        try:
+            with open(fd, "w", newline="", encoding="utf-8") as out:
+                rows = write_csv(
+                    out,
+                    iter_entries(CSV_CHUNK_ROWS, entry_columns(), **filters),
+                    progress and (lambda done: progress(done, total))
+                )
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        _csv_rows[path] = rows
+
+    expire_exports(version)
+    return path, rows
+
+# --------------------------------------------------
+# ZIP EXPORT
+# --------------------------------------------------
+# Photos are packed once, into segment archives under exports/images/ (or
+# images_compact/): an export writes one new segment holding just the
+# photos added since the last, and the pack's index file lists the current
+# segments. A data version's ZIP on disk is then only its CSV and a central
+# directory covering every segment's entries; open_export() serves it after
+# the segments' bytes, so no photo is copied per version. When photos leave
+# the export (garbage collection, archival), change size (a compact export
+# packed an original before its compact copy was made) or the pack reaches
+# PACK_MAX_SEGMENTS, it is rewritten as a single segment. Segments and the
+# index are written to a temporary file and renamed into place, so a crash
+# never leaves a damaged pack behind.
+PACK_MAX_SEGMENTS = 32
+
+def _pack_dir(compact):
+    return os.path.join(EXPORT_DIR, "images_compact" if compact else "images")
+
+def _replace_lines(path, lines):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            f.writelines(f"{line}\n" for line in lines)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _read_lines(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def _write_segment(pack_dir, sources, progress=None):
+    # A new segment of `sources`; returns its file name. progress, if given,
+    # is called with (photos written, photos to write).
+    fd, tmp = tempfile.mkstemp(dir=pack_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED, allowZip64=True) as zipf:
+            for done, (img, path, _) in enumerate(sources, 1):
+                ext = os.path.splitext(img)[1].lower()
+                compress = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                zipf.write(path, arcname=f"images/{img}", compress_type=compress)
+                if progress:
+                    progress(done, len(sources))
+        name = f"{uuid.uuid4().hex}.zip"
+        os.replace(tmp, os.path.join(pack_dir, name))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return name
+
+def _update_pack(compact=False, progress=None):
+    # Brings the pack up to date with the referenced photos and returns its
+    # segments as [(path, bytes before its central directory, entries)].
+    # Photos come from the manifest, so nothing is stat-ed.
+    pack_dir = _pack_dir(compact)
+    index = os.path.join(pack_dir, "index")
+    os.makedirs(pack_dir, exist_ok=True)
+    wanted = {f"images/{src[0]}": src for src in archive_sources(compact)}
+
+    with _path_lock(pack_dir):
+        segments = []
+        for name in _read_lines(index):
+            with zipfile.ZipFile(os.path.join(pack_dir, name)) as zipf:
+                segments.append((name, zipf.start_dir, zipf.infolist()))
+        packed = {info.filename: info.file_size for _, _, infos in segments for info in infos}
+        stale = [
+            arcname for arcname, size in packed.items()
+            if arcname not in wanted or wanted[arcname][2] != size
+        ]
+        if stale or len(segments) >= PACK_MAX_SEGMENTS:
+            segments, packed = [], {}
+
+        missing = [src for arcname, src in wanted.items() if arcname not in packed]
+        if missing or not os.path.exists(index):
+            if missing:
+                name = _write_segment(pack_dir, missing, progress)
+                with zipfile.ZipFile(os.path.join(pack_dir, name)) as zipf:
+                    segments.append((name, zipf.start_dir, zipf.infolist()))
+            _replace_lines(index, [name for name, _, _ in segments])
+        _expire_segments(pack_dir, {name for name, _, _ in segments})
+
+    return [(os.path.join(pack_dir, name), length, infos) for name, length, infos in segments]
+
+def _expire_segments(pack_dir, current):
+    # Segments dropped from the index stay for EXPORT_GRACE_SECONDS, for
+    # exports still being served from them.
+    now = time.time()
+    for name in os.listdir(pack_dir):
+        if name == "index" or name in current:
+            continue
+        path = os.path.join(pack_dir, name)
+        try:
+            if now - os.path.getmtime(path) > EXPORT_GRACE_SECONDS:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class _OffsetFile:
+    # A file written as though `offset` bytes of other data came before it,
+    # so zipfile records the offsets its entries have in the whole export.
+    def __init__(self, f, offset):
+        self.f = f
+        self.offset = offset
+
+    def write(self, data):
+        return self.f.write(data)
+
+    def tell(self):
+        return self.f.tell() + self.offset
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos -= self.offset
+        return self.f.seek(pos, whence) + self.offset
+
+    def flush(self):
+        self.f.flush()
+
+
+class _ExportReader(io.RawIOBase):
+    # The parts of an export, read back to back as one file.
+    def __init__(self, parts):
+        self.parts = parts
+        self.pos = 0
+        self.size = sum(length for _, length in parts)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.pos, os.SEEK_END: self.size}[whence]
+        self.pos = max(0, base + pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def readinto(self, buffer):
+        start = 0
+        for path, length in self.parts:
+            if self.pos < start + length:
+                with open(path, "rb") as f:
+                    f.seek(self.pos - start)
+                    n = f.readinto(memoryview(buffer)[:start + length - self.pos])
+                self.pos += n
+                return n
+            start += length
+        return 0
+
+
+def _export_parts(path):
+    # [(file, bytes used)] making up an export: for a ZIP, its pack segments
+    # then its own file; otherwise just the file.
+    lines = _read_lines(path + ".parts")
+    if not lines:
+        return [(path, os.path.getsize(path))]
+    return [(part, int(length)) for part, length in (line.split("\t") for line in lines)]
+
+def export_ready(path):
+    try:
+        return all(os.path.exists(part) for part, _ in _export_parts(path))
+    except (FileNotFoundError, ValueError):
+        return False
+
+def open_export(path):
+    # A binary file object for a finished export, to hand to st.download_button.
+    return _ExportReader(_export_parts(path))
+
+@metrics.instrument
+def build_zip(version, progress=None, compact=False):
+    # Progress counts photos packed, then CSV rows; the photo total is only
+    # known once the pack has been read, so the fraction may dip once when
+    # the CSV starts. `compact` uses the downscaled photo copies where they
+    # exist. Returns the path to pass to open_export().
+    max_id, count = version
+    suffix = "_compact" if compact else ""
+    path = os.path.join(EXPORT_DIR, f"outreach_{max_id}_{count}{suffix}.zip")
+    if export_ready(path):
+        return path
+
+    with _path_lock(path):
+        if export_ready(path):
+            return path
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+
+        photos_added = 0
+        def packing(done, total):
+            nonlocal photos_added
+            photos_added = done
+            progress(done, total + count)
+
+        segments = _update_pack(compact, progress and packing)
+        offset = sum(length for _, length, _ in segments)
+        fd, tmp = tempfile.mkstemp(dir=EXPORT_DIR, suffix=".tmp")
+        try:
+            with open(fd, "wb") as f:
+                with zipfile.ZipFile(_OffsetFile(f, offset), "w", allowZip64=True) as zipf:
+                    start = 0
+                    for _, length, infos in segments:
+                        for info in infos:
+                            info = copy.copy(info)
+                            info.header_offset += start
+                            zipf.filelist.append(info)
+                            zipf.NameToInfo[info.filename] = info
+                        start += length
+                    info = zipfile.ZipInfo("outreach_data.csv", time.localtime()[:6])
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    with zipf.open(info, "w", force_zip64=True) as raw:
+                        with io.TextIOWrapper(raw, encoding="utf-8", newline="") as out:
+                            write_csv(
+                                out,
+                                iter_entries(CSV_CHUNK_ROWS, entry_columns()),
+                                progress and (lambda rows: progress(photos_added + rows, photos_added + count))
+                            )
+            parts = [f"{seg}\t{length}" for seg, length, _ in segments]
+            _replace_lines(path + ".parts", parts + [f"{path}\t{os.path.getsize(tmp)}"])
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    expire_exports(version)
+    return path
+
+# --------------------------------------------------
+# EXPIRY
+# --------------------------------------------------
+# Every artifact is named after the data version it was built from. Once a
+# newer version exists it is stale, and is deleted EXPORT_GRACE_SECONDS
+# after it was written, so a download that is already under way finishes.
+# The photo packs expire their own segments (_expire_segments).
+def _path_lock(path):
+    with _export_lock:
+        return _path_locks.setdefault(path, threading.Lock())
+
+def _artifact_version(name):
+    parts = name.split(".", 1)[0].split("_")
+    return tuple(int(p) for p in parts[1:3]) if len(parts) >= 3 and parts[0] == "outreach" else None
+
+def expire_exports(version):
+    now = time.time()
+    for path in glob.glob(os.path.join(EXPORT_DIR, "outreach_*")):
+        built = _artifact_version(os.path.basename(path))
+        if built is None or built == tuple(version):
+            continue
+        try:
+            if now - os.path.getmtime(path) > EXPORT_GRACE_SECONDS:
+                os.unlink(path)
+                _csv_rows.pop(path, None)
+        except FileNotFoundError:
+            pass
+
+# --------------------------------------------------
+# COLUMNAR EXPORT (PARQUET / ARROW IPC)
+# --------------------------------------------------
+# camp_entries with an explicit schema: counts as the smallest integer type
+# that holds the column's largest value, camp_date as a date, created_at as
+# a timestamp and the repeated names dictionary-encoded. SQLite does the
+# casting; rows go out in batches of COLUMNAR_BATCH_ROWS, one Parquet row
+# group or IPC record batch each, so the table is never held in memory.
+def columnar_available():
+    return pa is not None
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet/Arrow export needs pyarrow (pip install pyarrow)")
+
+def _count_type(largest):
+    for arrow_type, limit in ((pa.int16(), 2 ** 15), (pa.int32(), 2 ** 31)):
+        if largest < limit:
+            return arrow_type
+    return pa.int64()
+
+def _if_iso_date(col, expr):
+    # SQLite's date functions read a bare number as a Julian day, which
+    # pyarrow then cannot cast; anything not starting YYYY-MM-DD is NULL.
+    return (
+        f"CASE WHEN {col} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*' "
+        f"THEN {expr} END"
+    )
+
+def _columnar_select(conn):
+    columns = entry_columns()
+    counts = [col for col in COUNT_COLUMNS if col in columns]
+    largest = conn.execute(
+        "SELECT " + ", ".join(f"MAX(ABS(CAST({col} AS INTEGER)))" for col in counts)
+        + " FROM camp_entries"
+    ).fetchone()
+
+    fields, select = [], []
+    for col in columns:
+        if col == "id":
+            continue
+        if col in CATEGORY_COLUMNS:
+            fields.append((col, pa.dictionary(pa.int32(), pa.string())))
+            select.append(col)
+        elif col in counts:
+            fields.append((col, _count_type(largest[counts.index(col)] or 0)))
+            select.append(f"CAST({col} AS INTEGER)")
+        elif col == "camp_date":
+            # Days since 1970-01-01; NULL for anything SQLite cannot read as a date.
+            fields.append((col, pa.date32()))
+            select.append(_if_iso_date(col, f"CAST(julianday(date({col})) - 2440587.5 AS INTEGER)"))
+        elif col == "created_at":
+            fields.append((col, pa.timestamp("ms")))
+            select.append(_if_iso_date(col, f"strftime('%Y-%m-%dT%H:%M:%f', {col})"))
+        elif col in ("latitude", "longitude"):
+            fields.append((col, pa.float64()))
+            select.append(f"CAST({col} AS REAL)")
+        elif col == "accuracy":
+            fields.append((col, pa.float32()))
+            select.append(f"CAST({col} AS REAL)")
+        else:
+            fields.append((col, pa.string()))
+            select.append(f"CAST({col} AS TEXT)")
+    return pa.schema(fields), f"SELECT {', '.join(select)} FROM camp_entries ORDER BY id"
+
+class _Dictionary:
+    # Codes stay stable across batches and the dictionary only grows, so
+    # IPC files can carry it as deltas and Parquet sees one value per code.
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, column):
+        indices = []
+        for value in column:
+            if value is None:
+                indices.append(None)
+                continue
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            indices.append(code)
+        return pa.DictionaryArray.from_arrays(
+            pa.array(indices, pa.int32()), pa.array(self.values, pa.string())
+        )
+
+def _record_batches(conn, schema, sql, batch_rows):
+    dictionaries = {
+        field.name: _Dictionary()
+        for field in schema if pa.types.is_dictionary(field.type)
+    }
+    cur = conn.execute(sql)
+    while True:
+        rows = cur.fetchmany(batch_rows)
+        if not rows:
+            return
+        arrays = []
+        for field, column in zip(schema, zip(*rows)):
+            if field.name in dictionaries:
+                arrays.append(dictionaries[field.name].encode(column))
+            elif pa.types.is_timestamp(field.type):
+                arrays.append(pa.array(column, pa.string()).cast(field.type))
+            else:
+                arrays.append(pa.array(column, field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def write_columnar(out, fmt="parquet", batch_rows=COLUMNAR_BATCH_ROWS, progress=None):
+    # progress, if given, is called with (rows written, total rows).
+    _require_pyarrow()
+    with read_connection() as conn:
+        schema, sql = _columnar_select(conn)
+        batches = _record_batches(conn, schema, sql, batch_rows)
+        if progress:
+            batches = _with_progress(batches, progress, count_entries())
+        if fmt == "parquet":
+            with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+        elif fmt == "arrow":
+            options = pa.ipc.IpcWriteOptions(compression="zstd", emit_dictionary_deltas=True)
+            with pa.ipc.new_file(out, schema, options=options) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+        else:
+            raise ValueError(f"unknown columnar format: {fmt}")
+
+def _with_progress(batches, progress, total):
+    done = 0
+    for batch in batches:
+        yield batch
+        done += batch.num_rows
+        progress(done, total)
+
+@metrics.instrument
+def build_columnar(version, fmt="parquet", progress=None):
+    _require_pyarrow()
+    max_id, count = version
+    ext = COLUMNAR_FORMATS[fmt]
+    path = os.path.join(EXPORT_DIR, f"outreach_{max_id}_{count}{ext}")
+    if os.path.exists(path):
+        return path
+
+    with _path_lock(path):
+        if os.path.exists(path):
+            return path
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=EXPORT_DIR, suffix=".tmp")
+        os.close(fd)
+        try:
+            write_columnar(tmp, fmt, progress=progress)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    expire_exports(version)
+    return path
+
+# --------------------------------------------------
+# BACKGROUND JOBS
+# --------------------------------------------------
+# Exports run on a small process-wide thread pool instead of the script
+# thread, so the page stays responsive and a build carries on if the user
+# navigates away. Jobs are keyed on what they build (kind, data version,
+# filters): every session asking for the same export shares one job and
+# its file. Pages keep the job id and poll it for progress.
+class ExportJob:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.state = "queued"
+        self.done = 0
+        self.total = 0
+        self.path = None
+        self.rows = None
+        self.error = None
+        self.finished_at = None
+
+    def update(self, done, total):
+        self.done, self.total = done, total
+
+    @property
+    def progress(self):
+        if self.state == "done":
+            return 1.0
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed")
+
+    def usable(self):
+        # A failed job, or one whose file has since expired, is rerun.
+        if self.state == "failed":
+            return False
+        return not self.finished or export_ready(self.path)
+
+
+_jobs = {}
+_jobs_by_key = {}
+_jobs_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+def _run_job(job, kind, version, filters):
+    # finished_at is set before the final state, which other sessions may
+    # read at any moment; whatever is raised, the job ends up finished.
+    job.state = "running"
+    state = "failed"
+    try:
+        if kind in ("zip", "zip-compact"):
+            job.path = build_zip(version, progress=job.update, compact=kind == "zip-compact")
+        elif kind == "csv":
+            job.path, job.rows = build_csv(version, progress=job.update, **filters)
+        else:
+            job.path = build_columnar(version, kind, progress=job.update)
+        state = "done"
+    except BaseException as exc:
+        job.error = f"{type(exc).__name__}: {exc}"
+        if not isinstance(exc, Exception):
+            raise
+    finally:
+        job.finished_at = time.monotonic()
+        job.state = state
+
+def _forget_old_jobs():
+    now = time.monotonic()
+    for job in list(_jobs.values()):
+        if (job.finished and job.finished_at is not None
+                and now - job.finished_at > EXPORT_JOB_TTL_SECONDS):
+            del _jobs[job.id]
+            if _jobs_by_key.get(job.key) is job:
+                del _jobs_by_key[job.key]
+
+def submit_export(kind, version, **filters):
+    # kind is "zip", "zip-compact", "csv" (which takes the build_csv
+    # filters), "parquet" or "arrow". Returns the ExportJob building it, new or shared.
+    if kind in COLUMNAR_FORMATS:
+        _require_pyarrow()
+    key = (kind, tuple(version), _filter_key(filters))
+    with _jobs_lock:
+        _forget_old_jobs()
+        job = _jobs_by_key.get(key)
+        if job is None or not job.usable():
+            job = ExportJob(key)
+            _jobs[job.id] = job
+            _jobs_by_key[key] = job
+            _executor.submit(_run_job, job, kind, version, filters)
+    return job
+
+def get_export_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
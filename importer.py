@@ -0,0 +1,101 @@
+import os
+import zipfile
+
+import pandas as pd
+
+from db import (
+    NATURAL_KEY, SQL_ENTRY_BY_NATURAL_KEY, archived_camps, entry_columns, write_connection
+)
+from photos import store_photo
+
+# Rows per read_csv chunk and per write transaction. Each transaction holds
+# the database write lock, so this also bounds how long a Submit on a live
+# server can be kept waiting.
+IMPORT_CHUNK_ROWS = 20000
+
+# --------------------------------------------------
+# CSV / ZIP IMPORT
+# --------------------------------------------------
+# Loads CSVs written by the share and export features (or the CSV inside an
+# exported ZIP, along with its images/ folder) into camp_entries. Rows whose
+# natural key (place, camp_date, doctor, created_at) already exists, here
+# or in the yearly archives, are skipped, as are rows whose submission_id
+# is already stored, so importing the same file twice is harmless.
+def _insert_sql(columns):
+    placeholders = ",".join(["?"] * len(columns))
+    return (
+        f"INSERT OR IGNORE INTO camp_entries ({','.join(columns)}) "
+        f"SELECT {placeholders} WHERE NOT EXISTS ({SQL_ENTRY_BY_NATURAL_KEY})"
+    )
+
+def _import_images(zipf):
+    # Returns {photo_name in the archive: photo_name in our store}.
+    renamed = {}
+    for info in zipf.infolist():
+        if info.is_dir() or not info.filename.startswith("images/"):
+            continue
+        old_name = info.filename[len("images/"):]
+        renamed[old_name] = store_photo(zipf.read(info), old_name)
+    return renamed
+
+def import_csv(source, stats, photo_map=None, chunksize=IMPORT_CHUNK_ROWS):
+    columns = entry_columns()
+    sql = _insert_sql(columns)
+    key_idx = [columns.index(col) for col in NATURAL_KEY]
+
+    chunks = pd.read_csv(
+        source,
+        dtype=str,
+        keep_default_na=False,
+        na_values=[""],
+        chunksize=chunksize
+    )
+    for chunk in chunks:
+        chunk.columns = [c.strip().lower() for c in chunk.columns]
+        stats["ignored_columns"].update(set(chunk.columns) - set(columns))
+        chunk = chunk.reindex(columns=columns).astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+
+        if photo_map:
+            chunk["photo_name"] = chunk["photo_name"].map(
+                lambda name: photo_map.get(name, name)
+            )
+
+        rows = [
+            row + tuple(row[i] for i in key_idx)
+            for row in chunk.itertuples(index=False, name=None)
+        ]
+        archived = archived_camps([row[len(columns):] for row in rows])
+        if archived:
+            rows = [row for row in rows if row[len(columns):] not in archived]
+        doctors = [(d,) for d in chunk["doctor"].dropna().unique()]
+
+        with write_connection() as conn:
+            cur = conn.executemany(sql, rows)
+            conn.executemany("INSERT OR IGNORE INTO doctors (name) VALUES (?)", doctors)
+
+        stats["rows"] += len(chunk)
+        stats["inserted"] += cur.rowcount
+
+def import_file(path, stats, chunksize=IMPORT_CHUNK_ROWS):
+    if not zipfile.is_zipfile(path):
+        import_csv(path, stats, chunksize=chunksize)
+        stats["files"] += 1
+        return
+
+    with zipfile.ZipFile(path) as zipf:
+        photo_map = _import_images(zipf)
+        stats["images"] += len(photo_map)
+        for name in zipf.namelist():
+            if name.lower().endswith(".csv") and "/" not in name:
+                with zipf.open(name) as f:
+                    import_csv(f, stats, photo_map, chunksize)
+                stats["files"] += 1
+
+def import_files(paths, chunksize=IMPORT_CHUNK_ROWS):
+    stats = {"files": 0, "rows": 0, "inserted": 0, "images": 0, "ignored_columns": set()}
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        import_file(path, stats, chunksize)
+    return stats
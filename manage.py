@@ -0,0 +1,200 @@
+import argparse
+from datetime import date, timedelta
+
+import api
+import db
+import export
+import importer
+import merge
+import photos
+
+# --------------------------------------------------
+# COMMANDS
+# --------------------------------------------------
+def cmd_explain(args):
+    db.init_db()
+    scans = 0
+    for name, sql, plan in db.explain_queries():
+        print(f"-- {name}")
+        print(sql)
+        # FTS5 lookups show up as "SCAN ... VIRTUAL TABLE INDEX", and a
+        # materialized (or co-routine) subquery is scanned after its own
+        # plan was checked.
+        materialized = {
+            step.split()[1] for step in plan if step.startswith(("MATERIALIZE ", "CO-ROUTINE "))
+        }
+        for step in plan:
+            full_scan = (
+                step.startswith("SCAN ")
+                and "USING" not in step
+                and "VIRTUAL TABLE INDEX" not in step
+                and step != "SCAN CONSTANT ROW"
+                and step.split()[1] not in materialized
+            )
+            scans += full_scan
+            print(f"   {step}{'   <-- full table scan' if full_scan else ''}")
+        print()
+    print(f"{scans} full table scan(s)")
+
+def cmd_gc_images(args):
+    db.init_db()
+    removed = photos.collect_garbage(
+        image_dir=args.image_dir,
+        grace_seconds=args.grace_hours * 3600,
+        dry_run=args.dry_run
+    )
+    for photo_name in removed:
+        print(photo_name)
+    verb = "would remove" if args.dry_run else "removed"
+    print(f"{verb} {len(removed)} unreferenced image(s)")
+
+def cmd_index_photos(args):
+    db.init_db()
+    if not photos.images_available():
+        print("Pillow is not installed: photos are listed, but no compact copies or thumbnails are made")
+    added, queued = photos.index_photos()
+    print(f"added {added} photo(s) to the manifest, made copies of {queued}")
+
+def cmd_import(args):
+    db.init_db()
+    stats = importer.import_files(args.paths, chunksize=args.chunk_rows)
+    print(
+        f"{stats['files']} file(s), {stats['rows']} row(s) read, "
+        f"{stats['inserted']} inserted, {stats['rows'] - stats['inserted']} duplicate(s) skipped, "
+        f"{stats['images']} image(s) stored"
+    )
+    if stats["ignored_columns"]:
+        print(f"ignored columns: {', '.join(sorted(stats['ignored_columns']))}")
+
+def cmd_merge(args):
+    db.init_db()
+    stats = merge.merge_databases(args.paths, image_dir=args.image_dir)
+    print(
+        f"{stats['databases']} database(s), {stats['rows_read']} row(s) read, "
+        f"{stats['rows_inserted']} inserted, {stats['doctors_added']} doctor(s) added, "
+        f"{stats['photos_copied']} photo(s) copied"
+    )
+    if stats["missing_photos"]:
+        print(f"{stats['missing_photos']} referenced photo(s) not found on the source device")
+
+def cmd_export(args):
+    db.init_db()
+    filters = {
+        "date_from": args.date_from, "date_to": args.date_to,
+        "doctor": args.doctor, "place": args.place, "since_id": args.since_id,
+        "include_archive": args.include_archive,
+    }
+    if args.format == "csv":
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            rows = export.write_csv(
+                f, db.iter_entries(export.CSV_CHUNK_ROWS, db.entry_columns(), **filters)
+            )
+    elif any(filters.values()):
+        raise SystemExit("filters apply to --format csv only")
+    else:
+        export.write_columnar(args.out, args.format, batch_rows=args.batch_rows)
+        rows = db.get_data_version()[1]
+    print(f"wrote {rows} camp entries to {args.out}")
+
+def cmd_archive(args):
+    db.init_db()
+    before = args.before or date.today() - timedelta(days=args.keep_days)
+    moved = db.archive_entries(before)
+    for year, count in moved.items():
+        print(f"archived {count} camp entries to {db.archive_path(year)}")
+    print(f"archived {sum(moved.values())} camp entries dated before {before}")
+    if args.vacuum:
+        db.vacuum()
+
+def cmd_rebuild_rollups(args):
+    db.init_db()
+    db.rebuild_rollups()
+    print(f"rebuilt rollups for {len(db.get_rollup_months())} month(s)")
+
+def cmd_rebuild_search(args):
+    db.init_db()
+    db.rebuild_search()
+    print("rebuilt the search index")
+
+def cmd_rebuild_locations(args):
+    db.init_db()
+    db.rebuild_locations()
+    print("rebuilt the GPS location index")
+
+def cmd_serve_api(args):
+    api.serve(args.host, args.port)
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Outreach camp database tools")
+    parser.add_argument("--db", default=db.DB_PATH, help="path to outreach.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("explain", help="print EXPLAIN QUERY PLAN for every app query")
+    p.set_defaults(func=cmd_explain)
+
+    p = sub.add_parser("gc-images", help="delete images no camp entry references")
+    p.add_argument("--image-dir", default=photos.IMAGE_DIR)
+    p.add_argument("--grace-hours", type=float, default=photos.GC_GRACE_SECONDS / 3600)
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_gc_images)
+
+    p = sub.add_parser("index-photos", help="fill the photo manifest and make compact copies")
+    p.set_defaults(func=cmd_index_photos)
+
+    p = sub.add_parser("import", help="load shared/exported CSV or ZIP files")
+    p.add_argument("paths", nargs="+", help="CSV files or exported ZIP archives")
+    p.add_argument("--chunk-rows", type=int, default=importer.IMPORT_CHUNK_ROWS)
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("merge", help="merge other devices' outreach.db files into this one")
+    p.add_argument("paths", nargs="+", help="device outreach.db files")
+    p.add_argument(
+        "--image-dir",
+        help="source photo folder (default: uploaded_images next to each database)"
+    )
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser("export", help="write camp entries as CSV, Parquet or Arrow IPC")
+    p.add_argument("out", help="output file")
+    p.add_argument("--format", choices=["csv"] + list(export.COLUMNAR_FORMATS), default="parquet")
+    p.add_argument("--batch-rows", type=int, default=export.COLUMNAR_BATCH_ROWS)
+    p.add_argument("--from", dest="date_from", help="first camp date (YYYY-MM-DD)")
+    p.add_argument("--to", dest="date_to", help="last camp date (YYYY-MM-DD)")
+    p.add_argument("--doctor")
+    p.add_argument("--place")
+    p.add_argument("--since-id", type=int, help="only entries with a higher id")
+    p.add_argument("--include-archive", action="store_true",
+                   help="also export camps moved to the yearly archives")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("archive", help="move old camp entries into yearly archive databases")
+    p.add_argument("--before", help="archive camps dated before this day (YYYY-MM-DD)")
+    p.add_argument("--keep-days", type=int, default=db.ARCHIVE_KEEP_DAYS,
+                   help="without --before, keep this many days of camps live")
+    p.add_argument("--vacuum", action="store_true", help="shrink outreach.db afterwards")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("rebuild-rollups", help="recompute the dashboard summary tables")
+    p.set_defaults(func=cmd_rebuild_rollups)
+
+    p = sub.add_parser("rebuild-search", help="recompute the full-text search index")
+    p.set_defaults(func=cmd_rebuild_search)
+
+    p = sub.add_parser("rebuild-locations", help="recompute the GPS location index")
+    p.set_defaults(func=cmd_rebuild_locations)
+
+    p = sub.add_parser("serve-api", help="run the JSON ingestion API")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8600)
+    p.set_defaults(func=cmd_serve_api)
+
+    args = parser.parse_args(argv)
+    db.DB_PATH = args.db
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
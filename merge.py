@@ -0,0 +1,135 @@
+import os
+import re
+import sqlite3
+
+from db import (
+    NATURAL_KEY, archive_years, archived_camps, entry_columns, readonly_uri, write_connection
+)
+from photos import photo_name_for, photo_path, store_photo
+
+# Names already produced by photos.store_photo: <sha[:2]>/<sha>.<ext>.
+HASHED_PHOTO_NAME = re.compile(r"^([0-9a-f]{2})/\1[0-9a-f]{62}\.\w+$")
+
+# --------------------------------------------------
+# DEVICE DATABASE MERGE
+# --------------------------------------------------
+# Folds the outreach.db (and uploaded_images/) of another device into ours.
+# Doctors are reconciled by name; camp entries are inserted when neither
+# their natural key (here or in the yearly archives) nor their
+# submission_id is already present; photos are
+# copied only when their content is not already in our store. Rows move SQLite-to-SQLite through
+# ATTACH, never through pandas.
+def _source_image_dir(source_db):
+    return os.path.join(os.path.dirname(os.path.abspath(source_db)), "uploaded_images")
+
+def _key_match(outer, inner):
+    return " AND ".join(f"{inner}.{col} IS {outer}.{col}" for col in NATURAL_KEY)
+
+def _copy_missing_photos(source_db, image_dir, stats):
+    # Runs before the write transaction, so hashing and copying files never
+    # holds the database write lock.
+    conn = sqlite3.connect(readonly_uri(source_db), uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT DISTINCT photo_name FROM camp_entries WHERE photo_name IS NOT NULL"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    photo_map = {}
+    for (old_name,) in rows:
+        src = os.path.join(image_dir, old_name)
+        if HASHED_PHOTO_NAME.match(old_name) and os.path.exists(photo_path(old_name)):
+            photo_map[old_name] = old_name
+            continue
+        if not os.path.exists(src):
+            stats["missing_photos"] += 1
+            continue
+        with open(src, "rb") as f:
+            data = f.read()
+        new_name = photo_name_for(data, old_name)
+        if not os.path.exists(photo_path(new_name)):
+            store_photo(data, old_name)
+            stats["photos_copied"] += 1
+        photo_map[old_name] = new_name
+    return photo_map
+
+def _archived_source_ids(source_db):
+    # Ids of source camps that were already moved to a yearly archive here.
+    # Like the photo copy, this runs outside the write transaction.
+    years = [str(year) for year in archive_years()]
+    if not years:
+        return []
+    conn = sqlite3.connect(readonly_uri(source_db), uri=True)
+    try:
+        rows = conn.execute(
+            f"SELECT id, {', '.join(NATURAL_KEY)} FROM camp_entries "
+            f"WHERE substr(camp_date, 1, 4) IN ({', '.join('?' * len(years))})",
+            years
+        ).fetchall()
+    finally:
+        conn.close()
+    archived = archived_camps([row[1:] for row in rows])
+    return [row[0] for row in rows if row[1:] in archived]
+
+def merge_database(source_db, stats, image_dir=None):
+    image_dir = image_dir or _source_image_dir(source_db)
+    photo_map = _copy_missing_photos(source_db, image_dir, stats)
+    archived_ids = _archived_source_ids(source_db)
+
+    with write_connection(attach={"src": source_db}) as conn:
+        src_columns = {row[1] for row in conn.execute("PRAGMA src.table_info(camp_entries)")}
+        columns = [col for col in entry_columns() if col in src_columns]
+        select = [
+            "COALESCE((SELECT new FROM temp.photo_map WHERE old = s.photo_name), s.photo_name)"
+            if col == "photo_name" else f"s.{col}"
+            for col in columns
+        ]
+
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS photo_map (old TEXT PRIMARY KEY, new TEXT)")
+        conn.execute("DELETE FROM temp.photo_map")
+        conn.executemany("INSERT INTO temp.photo_map VALUES (?, ?)", photo_map.items())
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archived_ids (id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.archived_ids")
+        conn.executemany("INSERT INTO temp.archived_ids VALUES (?)", [(i,) for i in archived_ids])
+
+        before = conn.total_changes
+        conn.execute("INSERT OR IGNORE INTO main.doctors (name) SELECT name FROM src.doctors")
+        conn.execute("""
+            INSERT OR IGNORE INTO main.doctors (name)
+            SELECT DISTINCT doctor FROM src.camp_entries WHERE doctor IS NOT NULL
+        """)
+        stats["doctors_added"] += conn.total_changes - before
+
+        cur = conn.execute(f"""
+            INSERT OR IGNORE INTO main.camp_entries ({', '.join(columns)})
+            SELECT {', '.join(select)}
+            FROM src.camp_entries s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM main.camp_entries m WHERE {_key_match('s', 'm')}
+            )
+            AND s.id NOT IN (SELECT id FROM temp.archived_ids)
+            ORDER BY s.id
+        """)
+        stats["rows_inserted"] += cur.rowcount
+        stats["rows_read"] += conn.execute("SELECT COUNT(*) FROM src.camp_entries").fetchone()[0]
+
+        conn.execute("DROP TABLE temp.photo_map")
+        conn.execute("DROP TABLE temp.archived_ids")
+
+    stats["databases"] += 1
+
+def merge_databases(paths, image_dir=None):
+    stats = {
+        "databases": 0,
+        "rows_read": 0,
+        "rows_inserted": 0,
+        "doctors_added": 0,
+        "photos_copied": 0,
+        "missing_photos": 0,
+    }
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        merge_database(path, stats, image_dir)
+    return stats
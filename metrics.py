@@ -0,0 +1,229 @@
+import functools
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+METRICS_FILE = "metrics.prom"
+METRICS_WRITE_INTERVAL_SECONDS = 15
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_lock = threading.Lock()
+_last_write = 0.0
+
+# --------------------------------------------------
+# PROCESS-WIDE REGISTRY
+# --------------------------------------------------
+# Histograms and counters across every session, written out in the
+# Prometheus text format (node_exporter textfile collector), so p95 rerun
+# latency is histogram_quantile(0.95, outreach_rerun_seconds_bucket).
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+HISTOGRAMS = {
+    "outreach_rerun_seconds": ("Script run duration", ("page",), {}),
+    "outreach_section_seconds": ("Script section duration", ("page", "section"), {}),
+    "outreach_db_helper_seconds": ("Data helper call duration", ("helper",), {}),
+}
+COUNTERS = {
+    "outreach_db_queries_total": ("SQL statements executed", ("page",), {}),
+    "outreach_db_rows_read_total": ("Rows returned by data helpers", ("helper",), {}),
+}
+
+def _observe(name, labels, value):
+    with _lock:
+        series = HISTOGRAMS[name][2]
+        series.setdefault(labels, Histogram()).observe(value)
+
+def _increment(name, labels, value):
+    with _lock:
+        series = COUNTERS[name][2]
+        series[labels] = series.get(labels, 0) + value
+
+def _labels(names, values):
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+
+def render_textfile():
+    lines = []
+    with _lock:
+        for name, (help_text, label_names, series) in HISTOGRAMS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for values, h in sorted(series.items()):
+                labels = _labels(label_names, values)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {h.sum:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {h.count}")
+        for name, (help_text, label_names, series) in COUNTERS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for values, total in sorted(series.items()):
+                lines.append(f"{name}{{{_labels(label_names, values)}}} {total}")
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path=None):
+    path = path or METRICS_FILE
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(render_textfile())
+    os.replace(tmp, path)
+
+# --------------------------------------------------
+# PER-RUN COLLECTION
+# --------------------------------------------------
+# One RunMetrics per script run, kept on the script thread. Pages call
+# start_run() at the top, checkpoint() after each section and finish_run()
+# at the bottom; data helpers report into whichever run is active.
+class RunMetrics:
+    def __init__(self, page):
+        self.page = page
+        self.started = time.perf_counter()
+        self.last_mark = self.started
+        self.sections = {}
+        self.helpers = {}
+        self.queries = 0
+        self.total = None
+
+    def add_helper(self, name, seconds, rows):
+        calls, total, total_rows = self.helpers.get(name, (0, 0.0, 0))
+        self.helpers[name] = (calls + 1, total + seconds, total_rows + rows)
+
+
+def current_run():
+    return getattr(_local, "run", None)
+
+def start_run(page):
+    _local.run = RunMetrics(page)
+    return _local.run
+
+def checkpoint(section):
+    run = current_run()
+    if run is None:
+        return
+    now = time.perf_counter()
+    run.sections[section] = run.sections.get(section, 0.0) + now - run.last_mark
+    run.last_mark = now
+
+def finish_run():
+    global _last_write
+    run = current_run()
+    if run is None:
+        return None
+    _local.run = None
+    run.total = time.perf_counter() - run.started
+
+    _observe("outreach_rerun_seconds", (run.page,), run.total)
+    for section, seconds in run.sections.items():
+        _observe("outreach_section_seconds", (run.page, section), seconds)
+    _increment("outreach_db_queries_total", (run.page,), run.queries)
+
+    now = time.monotonic()
+    if now - _last_write > METRICS_WRITE_INTERVAL_SECONDS:
+        _last_write = now
+        write_textfile()
+    return run
+
+def fragment(page, name):
+    # For st.fragment functions: inside a full run they are timed by the
+    # caller's checkpoint; rerun on their own they count as a run of
+    # "<page>:<name>".
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_run() is not None:
+                return func(*args, **kwargs)
+            start_run(f"{page}:{name}")
+            try:
+                return func(*args, **kwargs)
+            finally:
+                checkpoint(name)
+                finish_run()
+        return wrapper
+    return decorator
+
+def count_query(statement):
+    # sqlite3 trace callback: one call per statement on the calling thread.
+    run = current_run()
+    if run is not None:
+        run.queries += 1
+
+def _rows(result):
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    if isinstance(result, (pd.DataFrame, list)):
+        return len(result)
+    return 0
+
+def instrument(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        rows = _rows(result)
+
+        _observe("outreach_db_helper_seconds", (name,), seconds)
+        if rows:
+            _increment("outreach_db_rows_read_total", (name,), rows)
+        run = current_run()
+        if run is not None:
+            run.add_helper(name, seconds, rows)
+        return result
+    return wrapper
+
+# --------------------------------------------------
+# DEBUG SIDEBAR
+# --------------------------------------------------
+# Streamlit is imported only here, so db.py and the ingestion API, which
+# use the timers above, load without it.
+def debug_enabled():
+    import streamlit as st
+    return st.query_params.get("debug") == "1"
+
+def render_sidebar(run):
+    # Shown with ?debug=1 in the URL. Reports the run that just finished.
+    import streamlit as st
+    if run is None:
+        return
+    st.sidebar.subheader("⏱️ Run timings")
+    st.sidebar.metric("Total", f"{run.total * 1000:.1f} ms")
+    st.sidebar.caption(f"{run.queries} SQL statement(s)")
+    st.sidebar.dataframe(
+        pd.DataFrame(
+            [(name, round(s * 1000, 1)) for name, s in run.sections.items()],
+            columns=["section", "ms"]
+        ),
+        hide_index=True
+    )
+    st.sidebar.dataframe(
+        pd.DataFrame(
+            [
+                (name, calls, round(s * 1000, 1), rows)
+                for name, (calls, s, rows) in run.helpers.items()
+            ],
+            columns=["helper", "calls", "ms", "rows"]
+        ),
+        hide_index=True
+    )
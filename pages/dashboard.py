@@ -0,0 +1,48 @@
+import streamlit as st
+
+from db import init_db, get_rollup_months, load_rollup
+
+# --------------------------------------------------
+# INIT
+# --------------------------------------------------
+init_db()
+
+# --------------------------------------------------
+# UI
+# --------------------------------------------------
+# Everything here reads camp_rollups, which the insert trigger keeps up to
+# date, so the page costs the same at 1k or 1M camp entries.
+st.title("📊 Camp Statistics")
+
+months = get_rollup_months()
+if not months:
+    st.info("No records available yet.")
+    st.stop()
+
+month_from, month_to = st.select_slider(
+    "Months",
+    options=months,
+    value=(months[max(0, len(months) - 12)], months[-1])
+)
+
+view = st.radio(
+    "Totals by",
+    ["Month", "Doctor", "Place", "Administrator"],
+    horizontal=True
+)
+dimension = "total" if view == "Month" else view.lower()
+
+df = load_rollup(dimension, month_from, month_to)
+index = "month" if dimension == "total" else dimension
+
+# ---------------- HEADLINE ----------------
+c1, c2, c3, c4 = st.columns(4)
+c1.metric("Camps", int(df["camps"].sum()))
+c2.metric("OPD", int(df["opd_t"].sum()))
+c3.metric("Selected for Surgery", int(df["surg_t"].sum()))
+c4.metric("Brought to Hospital", int(df["hosp_t"].sum()))
+
+# ---------------- BREAKDOWN ----------------
+st.divider()
+st.bar_chart(df.set_index(index)[["opd_t", "surg_t", "hosp_t"]])
+st.dataframe(df, hide_index=True, use_container_width=True)
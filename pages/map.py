@@ -0,0 +1,46 @@
+import streamlit as st
+
+from db import init_db, load_location_clusters, CLUSTER_CELL_KM
+
+# --------------------------------------------------
+# INIT
+# --------------------------------------------------
+init_db()
+
+# --------------------------------------------------
+# UI
+# --------------------------------------------------
+# Camps with a GPS fix, grouped into cells of roughly district size by
+# load_location_clusters, so the map draws one point per cell rather than
+# one per camp.
+st.title("🗺️ Camp Map")
+
+c1, c2 = st.columns(2)
+cell_km = c1.select_slider(
+    "Cluster size (km)",
+    options=[5, 10, CLUSTER_CELL_KM, 50, 100],
+    value=CLUSTER_CELL_KM
+)
+dates = c2.date_input("Camp dates", value=())
+date_from, date_to = (dates + (None, None))[:2] if dates else (None, None)
+
+df = load_location_clusters(cell_km, date_from, date_to)
+if df.empty:
+    st.info("No GPS-tagged camps recorded yet.")
+    st.stop()
+
+c1, c2, c3 = st.columns(3)
+c1.metric("Areas", len(df))
+c2.metric("Camps", int(df["camps"].sum()))
+c3.metric("OPD", int(df["opd_t"].sum()))
+
+# Point size grows with the square root of the camp count, so busy areas
+# stand out without hiding their neighbours.
+df["size"] = df["camps"] ** 0.5 * cell_km * 60
+st.map(df, latitude="latitude", longitude="longitude", size="size")
+
+st.dataframe(
+    df.drop(columns=["cell_lat", "cell_lon", "size"]).round({"latitude": 4, "longitude": 4}),
+    hide_index=True,
+    use_container_width=True
+)
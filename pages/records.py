@@ -0,0 +1,65 @@
+import streamlit as st
+
+from db import init_db, get_doctors, load_entry_page
+
+PAGE_SIZES = [25, 50, 100]
+
+# --------------------------------------------------
+# INIT
+# --------------------------------------------------
+init_db()
+
+# --------------------------------------------------
+# SESSION STATE (PAGINATION)
+# --------------------------------------------------
+# Keyset cursors of the pages visited so far; the last one is the page on
+# screen. Changing a filter starts again from the newest camp.
+if "records_cursors" not in st.session_state:
+    st.session_state.records_cursors = [None]
+
+def reset_pages():
+    st.session_state.records_cursors = [None]
+
+# --------------------------------------------------
+# UI
+# --------------------------------------------------
+st.title("🗂️ Camp Records")
+
+# ---------------- FILTERS ----------------
+c1, c2 = st.columns(2)
+doctor = c1.selectbox(
+    "Doctor",
+    ["All"] + get_doctors(),
+    on_change=reset_pages
+)
+place = c2.text_input("Place starts with", on_change=reset_pages)
+
+c1, c2, c3 = st.columns(3)
+date_from = c1.date_input("From", value=None, on_change=reset_pages)
+date_to = c2.date_input("To", value=None, on_change=reset_pages)
+page_size = c3.selectbox("Rows per page", PAGE_SIZES, index=1, on_change=reset_pages)
+
+# ---------------- PAGE ----------------
+cursors = st.session_state.records_cursors
+df, next_cursor = load_entry_page(
+    cursors[-1],
+    page_size,
+    doctor=None if doctor == "All" else doctor,
+    place_prefix=place.strip() or None,
+    date_from=date_from,
+    date_to=date_to
+)
+
+if df.empty:
+    st.info("No records match these filters.")
+else:
+    st.dataframe(df, hide_index=True, use_container_width=True)
+
+c1, c2, c3 = st.columns([1, 2, 1])
+if c1.button("◀ Newer", disabled=len(cursors) == 1):
+    cursors.pop()
+    st.rerun()
+c2.caption(f"Page {len(cursors)}")
+if c3.button("Older ▶", disabled=next_cursor is None):
+    cursors.append(next_cursor)
+    st.rerun()
@@ -0,0 +1,44 @@
+import streamlit as st
+
+from db import init_db, search_entries, SEARCH_COLUMNS
+
+RESULT_COLUMNS = [
+    "place", "camp_date", "administrator", "doctor", "optom", "optom_intern",
+    "opd_t", "surg_t", "hosp_t",
+]
+FIELDS = {"All fields": None} | {
+    col.replace("_", " ").capitalize(): col for col in SEARCH_COLUMNS
+}
+
+# --------------------------------------------------
+# INIT
+# --------------------------------------------------
+init_db()
+
+# --------------------------------------------------
+# UI
+# --------------------------------------------------
+# Served by the camp_search FTS5 index: every word is matched as a prefix
+# of a name, and misspelt words fall back to the closest indexed names.
+st.title("🔎 Search Camps")
+
+c1, c2 = st.columns([3, 1])
+query = c1.text_input("Search places and staff names", placeholder="e.g. Rishikesh, Dr Sharma")
+field = c2.selectbox("Search in", list(FIELDS))
+
+if not query.strip():
+    st.stop()
+
+df, corrections = search_entries(query, FIELDS[field])
+
+if corrections:
+    replaced = ", ".join(
+        f"{word} → {' / '.join(words)}" for word, words in corrections.items()
+    )
+    st.caption(f"No exact matches; showing results for {replaced}.")
+
+if df.empty:
+    st.info("No camps match this search.")
+else:
+    st.caption(f"Best {len(df)} match(es)")
+    st.dataframe(df[RESULT_COLUMNS], hide_index=True, use_container_width=True)
@@ -0,0 +1,283 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # dimensions and compact copies need Pillow
+    Image = None
+
+import metrics
+from db import (
+    ARCHIVE_PHOTO_BYTES, SQL_ARCHIVE_BYTES, SQL_ARCHIVE_SOURCES,
+    archive_path, archive_years, read_connection, write_connection
+)
+
+IMAGE_DIR = "uploaded_images"
+
+# Downscaled copies live outside IMAGE_DIR, so garbage collection of
+# uploads never mistakes them for unreferenced photos.
+DERIVED_DIR = "derived_images"
+COMPACT_MAX_PX = 1600
+COMPACT_JPEG_QUALITY = 80
+THUMB_MAX_PX = 320
+THUMB_JPEG_QUALITY = 70
+PHOTO_WORKERS = 2
+
+# Unreferenced files younger than this are left alone by the garbage
+# collector: they may belong to a Submit that has not committed yet.
+GC_GRACE_SECONDS = 3600
+
+# --------------------------------------------------
+# CONTENT-ADDRESSED STORE
+# --------------------------------------------------
+# Photos are stored once per distinct content as <sha[:2]>/<sha>.<ext>
+# under IMAGE_DIR, and camp_entries.photo_name holds that relative path.
+# Files saved before this layout keep their flat timestamped names.
+def photo_name_for(data, filename):
+    digest = hashlib.sha256(data).hexdigest()
+    ext = os.path.splitext(filename)[1].lower() or ".jpg"
+    return f"{digest[:2]}/{digest}{ext}"
+
+def photo_path(photo_name, image_dir=None):
+    return os.path.join(image_dir or IMAGE_DIR, photo_name)
+
+@metrics.instrument
+def store_photo(data, filename, image_dir=None):
+    photo_name = photo_name_for(data, filename)
+    path = photo_path(photo_name, image_dir)
+    if os.path.exists(path):
+        return photo_name
+
+    # Write to a temp file in the same shard and rename, so a reader or a
+    # concurrent Submit never sees a half-written image.
+    _atomic_write(path, data)
+
+    record_photo(photo_name, data)
+    queue_derivatives(photo_name)
+    return photo_name
+
+def _atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+# --------------------------------------------------
+# MANIFEST
+# --------------------------------------------------
+# The photos table records every stored photo's size and dimensions at
+# upload, so exports can list and size their images with one query instead
+# of a stat per file.
+def images_available():
+    return Image is not None
+
+def _dimensions(data):
+    if Image is None:
+        return None, None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.size
+    except Exception:
+        return None, None
+
+def record_photo(photo_name, data):
+    width, height = _dimensions(data)
+    with write_connection() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO photos "
+            "(photo_name, sha256, bytes, width, height, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (photo_name, hashlib.sha256(data).hexdigest(), len(data), width, height,
+             datetime.now().isoformat())
+        )
+
+def archive_sources(compact=False):
+    # [(photo_name, path on disk, bytes)] for every photo a camp entry
+    # references, with the compact copy where there is one if `compact`.
+    # Photos missing from the manifest (stored before it existed) fall back
+    # to a stat.
+    sql = SQL_ARCHIVE_SOURCES.format(size=ARCHIVE_PHOTO_BYTES[compact])
+    with read_connection() as conn:
+        rows = conn.execute(sql).fetchall()
+
+    sources = []
+    for photo_name, compact_name, size in rows:
+        if size is None:
+            path = photo_path(photo_name)
+            if not os.path.exists(path):
+                continue
+            size = os.path.getsize(path)
+        elif compact and compact_name:
+            path = derived_path(compact_name)
+        else:
+            path = photo_path(photo_name)
+        sources.append((photo_name, path, size))
+    return sources
+
+@metrics.instrument
+def estimate_archive_bytes(compact=False):
+    # Total image bytes a ZIP export would hold, from the manifest alone.
+    sql = SQL_ARCHIVE_BYTES.format(size=ARCHIVE_PHOTO_BYTES[compact])
+    with read_connection() as conn:
+        total, missing = conn.execute(sql).fetchone()
+    return total, missing
+
+# --------------------------------------------------
+# COMPACT COPIES AND THUMBNAILS
+# --------------------------------------------------
+# A small worker pool makes, per photo, a compact copy (at most
+# COMPACT_MAX_PX on the long side, same format) for lighter exports and a
+# JPEG thumbnail for previews, both under DERIVED_DIR. Without Pillow
+# there are no copies and everything uses the original.
+_executor = ThreadPoolExecutor(max_workers=PHOTO_WORKERS, thread_name_prefix="photos")
+
+def derived_path(name):
+    return os.path.join(DERIVED_DIR, name)
+
+def _downscale(img, max_px, fmt, quality):
+    copy = img.copy()
+    copy.thumbnail((max_px, max_px))
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        copy.convert("RGB").save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        copy.save(buf, fmt, optimize=True)
+    return buf.getvalue()
+
+def make_derivatives(photo_name):
+    source = photo_path(photo_name)
+    with open(source, "rb") as f:
+        data = f.read()
+    stem = os.path.splitext(photo_name)[0]
+    ext = os.path.splitext(photo_name)[1].lower()
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        fmt = "PNG" if ext == ".png" else "JPEG"
+        compact = _downscale(img, COMPACT_MAX_PX, fmt, COMPACT_JPEG_QUALITY)
+        thumb = _downscale(img, THUMB_MAX_PX, "JPEG", THUMB_JPEG_QUALITY)
+
+    # A compact copy that saves nothing is not kept; exports use the original.
+    compact_name = None
+    if len(compact) < len(data):
+        compact_name = f"compact/{stem}{ext}"
+        _atomic_write(derived_path(compact_name), compact)
+    thumb_name = f"thumbs/{stem}.jpg"
+    _atomic_write(derived_path(thumb_name), thumb)
+
+    with write_connection() as conn:
+        conn.execute(
+            "UPDATE photos SET compact_name = ?, compact_bytes = ?, thumb_name = ?, thumb_bytes = ? "
+            "WHERE photo_name = ?",
+            (compact_name, len(compact) if compact_name else None, thumb_name, len(thumb),
+             photo_name)
+        )
+
+def _derive_quietly(photo_name):
+    # Unreadable images keep their original and just have no copies.
+    try:
+        make_derivatives(photo_name)
+    except Exception:
+        pass
+
+def queue_derivatives(photo_name):
+    if Image is None:
+        return None
+    return _executor.submit(_derive_quietly, photo_name)
+
+def thumbnail_path(photo_name):
+    # None until the worker pool has made the thumbnail.
+    with read_connection() as conn:
+        row = conn.execute(
+            "SELECT thumb_name FROM photos WHERE photo_name = ?", (photo_name,)
+        ).fetchone()
+    if row and row[0] and os.path.exists(derived_path(row[0])):
+        return derived_path(row[0])
+    return None
+
+def index_photos(wait=True):
+    # Adds referenced photos missing from the manifest (stored before it
+    # existed or copied in by hand) and queues copies for any that lack
+    # them. Returns (photos added, copies queued).
+    with read_connection() as conn:
+        unlisted = [r[0] for r in conn.execute("""
+            SELECT DISTINCT e.photo_name FROM camp_entries e
+            WHERE e.photo_name IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM photos p WHERE p.photo_name = e.photo_name)
+        """)]
+
+    added = 0
+    for photo_name in unlisted:
+        path = photo_path(photo_name)
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            record_photo(photo_name, f.read())
+        added += 1
+
+    with read_connection() as conn:
+        pending = [r[0] for r in conn.execute(
+            "SELECT photo_name FROM photos WHERE thumb_name IS NULL"
+        )]
+    futures = [f for f in map(queue_derivatives, pending) if f]
+    if wait:
+        for future in futures:
+            future.result()
+    return added, len(futures)
+
+# --------------------------------------------------
+# GARBAGE COLLECTION
+# --------------------------------------------------
+def referenced_photos():
+    # Archived camps keep their photos, so the yearly archives count too.
+    sql = "SELECT DISTINCT photo_name FROM {} WHERE photo_name IS NOT NULL"
+    with read_connection() as conn:
+        rows = conn.execute(sql.format("camp_entries")).fetchall()
+    for year in archive_years():
+        with read_connection(attach={"arc": archive_path(year)}) as conn:
+            rows += conn.execute(sql.format("arc.camp_entries")).fetchall()
+    return {r[0] for r in rows}
+
+def collect_garbage(image_dir=None, grace_seconds=GC_GRACE_SECONDS, dry_run=False):
+    image_dir = image_dir or IMAGE_DIR
+    referenced = referenced_photos()
+    cutoff = time.time() - grace_seconds
+    removed = []
+
+    for root, dirs, files in os.walk(image_dir, topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            photo_name = os.path.relpath(path, image_dir).replace(os.sep, "/")
+            if photo_name in referenced or os.path.getmtime(path) > cutoff:
+                continue
+            removed.append(photo_name)
+            if not dry_run:
+                os.unlink(path)
+
+        if root != image_dir and not dry_run and not os.listdir(root):
+            os.rmdir(root)
+
+    if removed and not dry_run:
+        _forget_photos(removed)
+    return removed
+
+def _forget_photos(photo_names):
+    # Manifest rows and copies of photos that garbage collection deleted.
+    with write_connection() as conn:
+        for photo_name in photo_names:
+            row = conn.execute(
+                "SELECT compact_name, thumb_name FROM photos WHERE photo_name = ?", (photo_name,)
+            ).fetchone()
+            for name in row or ():
+                if name and os.path.exists(derived_path(name)):
+                    os.unlink(derived_path(name))
+            conn.execute("DELETE FROM photos WHERE photo_name = ?", (photo_name,))
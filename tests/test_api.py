@@ -0,0 +1,165 @@
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+from PIL import Image
+
+import api
+import db
+import photos
+
+DOCTOR = "Dr Api"
+
+# --------------------------------------------------
+# INGESTION API RULES
+# --------------------------------------------------
+# entry_errors is shared by the Submit handlers and the API; the API also
+# has to turn every bad entry into a 422, never a 500 from the writer.
+@pytest.fixture(scope="module", autouse=True)
+def workdir(tmp_path_factory):
+    # The pool is per DB_PATH, so each module points it at its own file.
+    path = tmp_path_factory.mktemp("api")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(path)
+        mp.setattr(db, "DB_PATH", str(path / "outreach.db"))
+        db.init_db()
+        db.add_doctor(DOCTOR)
+        yield path
+
+
+@pytest.fixture(scope="module")
+def server(workdir):
+    httpd = api.ThreadingHTTPServer(("127.0.0.1", 0), api.IngestHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _entry(**fields):
+    entry = {
+        "place": "Api Camp", "camp_date": "2024-05-01", "administrator": "Admin",
+        "doctor": DOCTOR, "optom": "Optom", "optom_intern": "Intern",
+        "opd_m": 3, "opd_f": 4, "surg_m": 2, "surg_f": 1, "hosp_m": 1, "hosp_f": 1,
+    }
+    entry.update(fields)
+    return entry
+
+def _post(url, body, content_type):
+    request = urllib.request.Request(
+        f"{url}/entries", data=body, headers={"Content-Type": content_type}, method="POST"
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as exc:
+        return exc.code, json.load(exc)
+
+def _post_json(url, payload):
+    return _post(url, json.dumps(payload).encode(), "application/json")
+
+def _post_multipart(url, payload, files):
+    boundary = "apitestboundary"
+    parts = [(
+        'name="entries"', "application/json", json.dumps(payload).encode()
+    )] + [
+        (f'name="{name}"; filename="{filename}"', "application/octet-stream", data)
+        for name, (filename, data) in files.items()
+    ]
+    body = b"".join(
+        f"--{boundary}\r\nContent-Disposition: form-data; {disposition}\r\n"
+        f"Content-Type: {kind}\r\n\r\n".encode() + data + b"\r\n"
+        for disposition, kind, data in parts
+    ) + f"--{boundary}--\r\n".encode()
+    return _post(url, body, f"multipart/form-data; boundary={boundary}")
+
+def _stored(entry_id, columns):
+    with db.read_connection() as conn:
+        return conn.execute(
+            f"SELECT {', '.join(columns)} FROM camp_entries WHERE id = ?", (entry_id,)
+        ).fetchone()
+
+def _png():
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_valid_entry_has_no_errors():
+    assert db.entry_errors(_entry(), {DOCTOR}) == []
+
+def test_totals_that_match_their_counts_are_accepted():
+    assert db.entry_errors(_entry(opd_t=7, surg_t=3, hosp_t=2)) == []
+
+@pytest.mark.parametrize("totals", [
+    {"opd_t": 120, "surg_t": 10, "hosp_t": 8},
+    {"opd_t": 8},
+])
+def test_totals_that_differ_from_their_counts_are_rejected(totals):
+    errors = db.entry_errors(_entry(**totals))
+    assert any("Totals must equal their counts" in e for e in errors)
+
+def test_totals_only_entry_is_rejected_not_zeroed():
+    entry = {k: v for k, v in _entry().items() if k not in db.COUNT_COLUMNS}
+    with pytest.raises(api.RequestError) as exc:
+        api.ingest([{**entry, "opd_t": 120, "surg_t": 10, "hosp_t": 8}], {})
+    assert exc.value.status == 422
+
+def test_hospital_total_cannot_exceed_surgery_total():
+    errors = db.entry_errors(_entry(surg_m=1, surg_f=0, hosp_m=50, hosp_f=0, surg_t=1, hosp_t=50))
+    assert errors == ["Hospital total cannot exceed surgery total."]
+
+@pytest.mark.parametrize("value", [10**30, db.MAX_COUNT + 1, -1, 1.5, True])
+def test_counts_out_of_range_are_rejected(value):
+    errors = db.entry_errors(_entry(opd_m=value))
+    assert any("Counts must be whole numbers" in e for e in errors)
+
+def test_largest_count_is_accepted():
+    assert db.entry_errors(_entry(opd_m=db.MAX_COUNT, opd_f=0)) == []
+
+def test_doctor_must_be_in_the_list():
+    assert db.entry_errors(_entry(doctor="Dr Nobody"), {DOCTOR}) == ["Unknown doctor 'Dr Nobody'."]
+    assert db.entry_errors(_entry(doctor="Dr Nobody")) == []
+
+
+def test_post_json_recomputes_totals(server):
+    status, body = _post_json(server, _entry(place="Json Camp", opd_t=7))
+    assert status == 200
+    [result] = body["results"]
+    assert result["inserted"]
+    assert _stored(result["id"], ["opd_t", "surg_t", "hosp_t"]) == (7, 3, 2)
+
+@pytest.mark.parametrize("fields", [
+    {"opd_m": 10**30},
+    {"opd_t": 120, "surg_t": 10, "hosp_t": 8},
+    {"doctor": "Dr Nobody"},
+    {"camp_date": "01/05/2024"},
+])
+def test_post_json_bad_entry_is_422(server, fields):
+    status, body = _post_json(server, [_entry(place="Good Camp"), _entry(**fields)])
+    assert status == 422
+    assert list(body["errors"]) == ["1"]
+
+def test_post_multipart_stores_the_photo(server):
+    data = _png()
+    status, body = _post_multipart(
+        server, [_entry(place="Photo Camp", photo="pic")], {"pic": ("camp.png", data)}
+    )
+    assert status == 200
+    [photo_name] = _stored(body["results"][0]["id"], ["photo_name"])
+    assert photo_name.endswith(".png")
+    with open(photos.photo_path(photo_name), "rb") as f:
+        assert f.read() == data
+
+@pytest.mark.parametrize("payload, files", [
+    ([_entry(photo="missing")], {}),
+    ([_entry(photo="pic")], {"pic": ("camp.gif", b"GIF89a")}),
+    ([_entry(photo=3)], {}),
+])
+def test_post_multipart_bad_photo_is_422(server, payload, files):
+    status, body = _post_multipart(server, payload, files)
+    assert status == 422
+    assert list(body["errors"]) == ["0"]
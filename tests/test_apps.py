@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import db
+import export
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = ["app.py", "app_gps.py"]
+PAGES = ["pages/dashboard.py", "pages/records.py", "pages/search.py", "pages/map.py"]
+DOCTOR = "Dr Smoke"
+
+# --------------------------------------------------
+# SMOKE TESTS (AppTest)
+# --------------------------------------------------
+# Every script has to get through a first run, a rerun and a Submit without
+# an exception; Streamlit API removals and misuse only show up at runtime.
+@pytest.fixture(scope="module", autouse=True)
+def workdir(tmp_path_factory):
+    # DB_PATH and the image/export directories are relative, so each test
+    # module works in its own directory.
+    path = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(path)
+        db.init_db()
+        db.add_doctor(DOCTOR)
+        yield path
+
+
+def _run(script, **query):
+    at = AppTest.from_file(os.path.join(REPO_DIR, script), default_timeout=60)
+    at.query_params.update(query)
+    return at.run()
+
+def _errors(at):
+    return [e.value for e in at.exception]
+
+def _fill_and_submit(at, place):
+    labels = {
+        "Place of Camp": place,
+        "Administrator Name": "Smoke Admin",
+        "Optom Name": "Smoke Optom",
+        "Optom Intern Name": "Smoke Intern",
+    }
+    for widget in at.text_input:
+        if widget.label in labels:
+            widget.input(labels[widget.label])
+    next(w for w in at.selectbox if w.label == "Doctor Name").select(DOCTOR)
+    next(b for b in at.button if "Submit" in b.label).click()
+    return at.run()
+
+
+@pytest.mark.parametrize("script", APPS + PAGES)
+def test_first_run_and_rerun(script):
+    at = _run(script)
+    assert not _errors(at)
+    assert not _errors(at.run())
+
+def test_gps_app_reads_location_from_query_params():
+    at = _run("app_gps.py", lat="30.1", lon="78.3", acc="12")
+    assert not _errors(at)
+    assert any("30.100000, 78.300000" in s.value for s in at.success)
+
+@pytest.mark.parametrize("script", APPS)
+def test_submit(script):
+    before = db.count_entries()
+    at = _fill_and_submit(_run(script), f"Smoke {script}")
+    assert not _errors(at)
+    assert db.count_entries() == before + 1
+
+def test_share_this_camp_after_submit():
+    at = _fill_and_submit(_run("app.py"), "Share Village")
+    assert not _errors(at)
+    assert not any("to share just this camp" in i.value for i in at.info)
+    next(b for b in at.button if b.label == "Prepare CSV for sharing").click()
+    assert not _errors(at.run())
+
+def test_data_layer_imports_without_streamlit():
+    # The ingestion API and the CLI run without a Streamlit runtime.
+    check = "import sys, db, api, photos; assert 'streamlit' not in sys.modules"
+    subprocess.run([sys.executable, "-c", check], cwd=REPO_DIR, check=True)
+
+def test_export_progress_survives_full_reruns(monkeypatch):
+    # A Submit (a full-app rerun) while an export is still building must
+    # not trip over the export section's polling.
+    release = threading.Event()
+    build_zip = export.build_zip
+    monkeypatch.setattr(export, "build_zip", lambda *a, **k: release.wait(30) and build_zip(*a, **k))
+
+    at = _fill_and_submit(_run("app_gps.py"), "Export Village")
+    next(b for b in at.button if b.label.startswith("Prepare")).click()
+    at.run()
+    assert not _errors(at)
+    assert at.get("progress")
+
+    at = _fill_and_submit(at, "Export Village 2")
+    assert not _errors(at)
+
+    release.set()
+    job = export.get_export_job(at.session_state["export_job"])
+    for _ in range(100):
+        if job.finished:
+            break
+        threading.Event().wait(0.1)
+    at.run()
+    assert not _errors(at)
+    assert job.state == "done"
+    # The export is read when the button is clicked, not on each rerun.
+    [button] = at.get("download_button")
+    assert button.proto.deferred_file_id and not button.proto.url
@@ -0,0 +1,124 @@
+import sqlite3
+
+import pytest
+
+import db
+import export
+import importer
+import merge
+
+OLD_DOCTOR = "Dr Archived"
+NEW_DOCTOR = "Dr Live"
+CUTOFF = "2024-01-01"
+
+# --------------------------------------------------
+# ARCHIVAL BOOKKEEPING
+# --------------------------------------------------
+# Archived camps leave camp_entries but stay in the counts, the rollups and
+# the doctor usage; importing or merging them again, or archiving twice,
+# must not change any of those.
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # The pool is per DB_PATH, so each test points it at its own file.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "outreach.db"))
+    db.init_db()
+    db.add_doctor(OLD_DOCTOR)
+    db.add_doctor(NEW_DOCTOR)
+    db.save_entries([
+        _entry("Rishikesh", "2023-03-01", OLD_DOCTOR, opd_m=5),
+        _entry("Haridwar", "2023-07-15", OLD_DOCTOR, opd_m=7),
+        _entry("Dehradun", "2023-11-30", NEW_DOCTOR, opd_m=2),
+        _entry("Rishikesh", "2025-02-01", NEW_DOCTOR, opd_m=11),
+    ])
+    return tmp_path
+
+
+def _entry(place, camp_date, doctor, **counts):
+    return db.complete_entry({
+        "place": place, "camp_date": camp_date, "administrator": "Admin",
+        "doctor": doctor, "optom": "Optom", "optom_intern": "Intern",
+        "created_at": f"{camp_date}T09:30:00", **counts,
+    })
+
+def _books():
+    # Everything archival has to leave unchanged.
+    total = db.load_rollup("total", "0000-01", "9999-12")
+    by_doctor = db.load_rollup("doctor", "0000-01", "9999-12")
+    return {
+        "camps": db.count_entries(include_archive=True),
+        "rollup_camps": int(total["camps"].sum()),
+        "rollup_opd": int(total["opd_t"].sum()),
+        "by_doctor": dict(zip(by_doctor["doctor"], by_doctor["camps"].astype(int))),
+        "used": (db.is_doctor_used(OLD_DOCTOR), db.is_doctor_used(NEW_DOCTOR)),
+    }
+
+def _export_csv(path):
+    with open(path, "w", encoding="utf-8", newline="") as out:
+        export.write_csv(out, db.iter_entries(columns=db.entry_columns()))
+
+def _copy_database(path):
+    target = sqlite3.connect(path)
+    with db.read_connection() as conn:
+        conn.backup(target)
+    target.close()
+
+
+def test_archive_keeps_the_books():
+    before = _books()
+    assert db.archive_entries(CUTOFF) == {2023: 3}
+    assert db.count_entries() == 1
+    assert _books() == before
+    assert before["used"] == (True, True)
+
+def test_reimport_after_archive_adds_nothing(workdir):
+    _export_csv(workdir / "shared.csv")
+    before = _books()
+    db.archive_entries(CUTOFF)
+
+    stats = importer.import_files([str(workdir / "shared.csv")])
+    assert (stats["rows"], stats["inserted"]) == (4, 0)
+    assert db.count_entries() == 1
+    assert _books() == before
+
+    assert db.archive_entries(CUTOFF) == {}
+    assert _books() == before
+
+def test_archiving_a_copy_of_an_archived_camp_drops_it_from_the_rollups():
+    # A copy that got in before the import check existed (or by hand) is
+    # deleted rather than moved, so it has to leave the rollups as well.
+    before = _books()
+    db.archive_entries(CUTOFF)
+    db.save_entries([_entry("Rishikesh", "2023-03-01", OLD_DOCTOR, opd_m=5)])
+    assert _books()["rollup_camps"] == before["rollup_camps"] + 1
+
+    assert db.archive_entries(CUTOFF) == {2023: 1}
+    assert db.count_entries() == 1
+    assert _books() == before
+
+def test_merge_of_archived_camps_adds_only_new_ones(workdir):
+    device = workdir / "device.db"
+    _copy_database(device)
+    db.archive_entries(CUTOFF)
+    before = _books()
+
+    # The device also has a camp of the archived year that was never here.
+    with sqlite3.connect(device) as conn:
+        conn.execute(
+            "INSERT INTO camp_entries (place, camp_date, doctor, created_at, opd_m, opd_t) "
+            "VALUES ('Rishikesh', '2023-05-05', ?, '2023-05-05T09:30:00', 4, 4)",
+            (OLD_DOCTOR,)
+        )
+    conn.close()
+
+    stats = merge.merge_databases([str(device)])
+    assert (stats["rows_read"], stats["rows_inserted"]) == (5, 1)
+    after = _books()
+    assert after["camps"] == before["camps"] + 1
+    assert after["rollup_camps"] == before["rollup_camps"] + 1
+    assert after["rollup_opd"] == before["rollup_opd"] + 4
+
+    assert db.archive_entries(CUTOFF) == {2023: 1}
+    assert _books() == after
+    assert merge.merge_databases([str(device)])["rows_inserted"] == 0
+    assert _books() == after
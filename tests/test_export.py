@@ -0,0 +1,111 @@
+import io
+import os
+import zipfile
+
+import pytest
+from PIL import Image
+
+import db
+import export
+import photos
+
+DOCTOR = "Dr Export"
+
+# --------------------------------------------------
+# ZIP EXPORT
+# --------------------------------------------------
+# The photo pack is reused across data versions, so each export has to
+# hold exactly the photos (and the copies of them) the manifest names.
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # The pool is per DB_PATH, so each test points it at its own file.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "outreach.db"))
+    db.init_db()
+    db.add_doctor(DOCTOR)
+    return tmp_path
+
+
+def _save(place, photo_name=None):
+    db.save_entries([db.complete_entry({
+        "place": place, "camp_date": "2024-05-01", "administrator": "Admin",
+        "doctor": DOCTOR, "optom": "Optom", "optom_intern": "Intern",
+        "opd_m": 1, "opd_f": 1, "photo_name": photo_name,
+        "created_at": f"2024-05-01T10:00:{len(place):02d}",
+    })])
+
+def _large_jpeg():
+    # Noise, so the compact copy is much smaller than the original.
+    img = Image.frombytes("RGB", (2400, 1800), os.urandom(2400 * 1800 * 3))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=95)
+    return buf.getvalue()
+
+def _export_zip(compact):
+    path = export.build_zip(db.get_data_version(), compact=compact)
+    with export.open_export(path) as f:
+        data = f.read()
+    return data, zipfile.ZipFile(io.BytesIO(data))
+
+
+def test_each_version_adds_only_new_photos(monkeypatch):
+    monkeypatch.setattr(photos, "queue_derivatives", lambda photo_name: None)
+    first = photos.store_photo(b"first photo", "a.jpg")
+    _save("Camp A", first)
+    _, zipf = _export_zip(compact=False)
+    assert zipf.read(f"images/{first}") == b"first photo"
+
+    second = photos.store_photo(b"second photo", "b.jpg")
+    _save("Camp B", second)
+    _, zipf = _export_zip(compact=False)
+    assert zipf.testzip() is None
+    assert zipf.read(f"images/{first}") == b"first photo"
+    assert zipf.read(f"images/{second}") == b"second photo"
+    assert len(os.listdir(export._pack_dir(False))) == 3  # two segments and the index
+
+def test_compact_export_replaces_originals_once_copies_exist(monkeypatch):
+    # A compact export made before the thumbnail worker has run packs the
+    # original; once the compact copy exists, the next export carries it.
+    monkeypatch.setattr(photos, "queue_derivatives", lambda photo_name: None)
+    original = _large_jpeg()
+    photo_name = photos.store_photo(original, "camp.jpg")
+    _save("Camp A", photo_name)
+    _, zipf = _export_zip(compact=True)
+    assert zipf.read(f"images/{photo_name}") == original
+
+    photos.make_derivatives(photo_name)
+    _save("Camp B")
+    data, zipf = _export_zip(compact=True)
+    with db.read_connection() as conn:
+        [compact_name] = conn.execute(
+            "SELECT compact_name FROM photos WHERE photo_name = ?", (photo_name,)
+        ).fetchone()
+    with open(photos.derived_path(compact_name), "rb") as f:
+        assert zipf.read(f"images/{photo_name}") == f.read()
+    image_bytes, _ = photos.estimate_archive_bytes(compact=True)
+    assert len(data) < image_bytes + 64 * 1024
+
+
+# --------------------------------------------------
+# EXPORT JOBS
+# --------------------------------------------------
+@pytest.mark.parametrize("error", [OSError("disk full"), KeyboardInterrupt()])
+def test_failed_job_is_finished_whatever_was_raised(monkeypatch, error):
+    def build_zip(*args, **kwargs):
+        raise error
+    monkeypatch.setattr(export, "build_zip", build_zip)
+    job = export.ExportJob(("zip", (1, 1), ()))
+    try:
+        export._run_job(job, "zip", (1, 1), {})
+    except BaseException as exc:
+        assert exc is error and not isinstance(exc, Exception)
+    assert job.state == "failed" and job.finished_at is not None
+    assert type(error).__name__ in job.error
+
+def test_forgetting_jobs_skips_one_still_being_finished(monkeypatch):
+    # A job can count as finished a moment before finished_at is set.
+    job = export.ExportJob(("zip", (1, 1), ()))
+    job.state = "done"
+    monkeypatch.setitem(export._jobs, job.id, job)
+    export._forget_old_jobs()
+    assert export._jobs[job.id] is job